@@ -3,23 +3,21 @@ This file stands for the main entry point
 of the whole algorithm.
 """
 
-from instantiation import Adversities
+from instantiation import Adversities, Tree
 from genetic_programming import GeneticProgrammer
-import numpy as np
+from termination import TargetFitness, MaxWallTime
 from matplotlib import pyplot as plt
-import random
 
 if __name__ == "__main__":
-	random.seed(2)
-	np.random.seed(2)
-
 	n_individuals = 10
 	max_iter = 100
 	level = ['P', 'P', 'P', 'H', 'H', 'P', 'P', 'P', 'H', 'P', 'P', 'P', 'P', 'H', 'P', 'P', 'E', 'E', 'P', 'P']
 
-	gp = GeneticProgrammer(n_individuals=n_individuals, max_initial_height=5)  # , crossover_prob=1., mutation_prob=1., mutation_rate=0.5)
-	fittest = gp.find_solution(max_iter=max_iter, level=level)
+	gp = GeneticProgrammer(n_individuals=n_individuals, max_initial_height=5, seed=2)  # , crossover_prob=1., mutation_prob=1., mutation_rate=0.5)
+	fittest = gp.find_solution(max_iter=max_iter, level=level, termination=TargetFitness(1.) | MaxWallTime(60.))
+	print 'stopped:', gp.stop_reason
 	print fittest.fitness
+	print 'fitness evaluations:', Tree.n_evaluations, 'avoided:', Tree.evaluations_avoided()
 	fittest.plot()
 	plt.show()
 
@@ -7,9 +7,37 @@ contains genetic operators (such as crossover and mutation).
 """
 
 from instantiation import *
+from termination import RunState, MaxGenerations, AnyOf
+import library as tree_library
 
 
-class GeneticProgrammer:
+def make_rng(seed=None):
+	"""
+	:param seed: An integer seed, or None for fresh entropy.
+	:return: A numpy.random.RandomState stream. RandomState is used rather than the Generator
+		API of numpy >= 1.17, which is not available on Python 2.
+	"""
+	return np.random.RandomState(seed)
+
+
+def spawn_seeds(seed, n):
+	"""
+	Deterministically derives seeds for independent streams from a single seed, e.g. one per worker.
+
+	:param seed: The seed to derive from.
+	:param n: Number of seeds to derive.
+	:return: A list of n distinct integer seeds. The same seed always derives the same list.
+	"""
+	seeds = []
+	stream = np.random.RandomState(seed)
+	while len(seeds) < n:
+		drawn = int(stream.randint(0, 2 ** 31 - 1))
+		if drawn not in seeds:
+			seeds += [drawn]
+	return seeds
+
+
+class GeneticProgrammer(object):  # new-style, so the max_depth setter works on Python 2
 
 	_n_individuals = None
 	_elitism_rate = None
@@ -18,6 +46,13 @@ class GeneticProgrammer:
 	_mutation_rate = None
 	_mutation_prob = None
 	_max_initial_height = None
+	_stop_reason = None
+	_run_state = None
+	_evaluator = None
+	_library = None
+	_library_rate = None
+	_rng = None
+	_max_depth = None
 
 	def __init__(self, **kwargs):
 		"""
@@ -39,6 +74,27 @@ class GeneticProgrammer:
 
 		:param max_initial_height: Maximum size of initial trees in the population. Defaults to 5.
 
+		:param evaluator: optional callable that receives a list of trees and returns their fitness
+			values. Used to evaluate, in a single batch, every individual changed since the last
+			generation. Defaults to evaluating individuals one by one.
+
+		:type library: library.TreeLibrary
+		:param library: library of minimal trees, used to seed the initial population and as a source
+			of subtrees for mutation. Defaults to the library stored with this package. None disables it.
+
+		:param library_rate: percentage of the initial population drawn from the library, each
+			individual with a distinct behaviour. Default value is 0.5 (50%).
+
+		:param seed: integer seed of the random stream of this genetic programmer (e.g. one of
+			the seeds given by spawn_seeds, one per worker). Runs with the same seed are identical.
+			Defaults to fresh entropy.
+
+		:type rng: numpy.random.RandomState
+		:param rng: random stream to draw from, instead of one built from seed.
+
+		:param max_depth: maximum depth of the offspring of crossover and library mutations.
+			Changes that would exceed it are undone. Defaults to None (unbounded).
+
 		:type level: list
 		:param level: The problem to be optimized.
 
@@ -50,6 +106,38 @@ class GeneticProgrammer:
 		self._mutation_rate = 0.05 if 'mutation_rate' not in kwargs else max(0., kwargs['mutation_rate'])
 		self._mutation_prob = 0.03 if 'mutation_prob' not in kwargs else max(0., kwargs['mutation_prob'])
 		self._max_initial_height = 5 if 'max_initial_height' not in kwargs else max(2, kwargs['max_initial_height'])
+		self._evaluator = kwargs.get('evaluator', None)
+		self._library = tree_library.load() if 'library' not in kwargs else kwargs['library']
+		self._library_rate = 0.5 if 'library_rate' not in kwargs else max(0., kwargs['library_rate'])
+		self._rng = kwargs['rng'] if 'rng' in kwargs else make_rng(kwargs.get('seed', None))
+		self._max_depth = kwargs.get('max_depth', None)
+
+	@property
+	def stop_reason(self):
+		"""
+		:return: Why the last call to find_solution stopped.
+		"""
+		return self._stop_reason
+
+	@property
+	def library(self):
+		return self._library
+
+	@property
+	def max_depth(self):
+		return self._max_depth
+
+	@max_depth.setter
+	def max_depth(self, value):
+		self._max_depth = value
+
+	@property
+	def run_state(self):
+		"""
+		:return: The termination.RunState of the last call to find_solution (generations,
+			evaluations and elapsed time).
+		"""
+		return self._run_state
 
 	def __sample__(self, level):
 		"""
@@ -60,15 +148,22 @@ class GeneticProgrammer:
 		tests = Tests.__members__.values()
 		actions = Actions.__members__.values()
 
-		for i, individual in enumerate(population):
-			root = Node(value=np.random.choice(tests))
+		n_seeded = 0
+		if self._library is not None:
+			n_seeded = min(int(round(self._library_rate * self._n_individuals)), len(self._library.behaviours))
+			behaviours = self._rng.choice(self._library.behaviours, size=n_seeded, replace=False)
+			for i, index in enumerate(behaviours):
+				population[i] = Tree(root=self._library.tree(index, test_root=True), level=level)
+
+		for i in xrange(n_seeded, self._n_individuals):
+			root = Node(value=self._rng.choice(tests))
 
 			tree_tests = [root]
 			while len(tree_tests) > 0:  # while there are any non-terminal nodes without children
 				if root.depth_below() + 1 < self._max_initial_height:
-					draw = Node(np.random.choice(tests + actions))
+					draw = Node(self._rng.choice(tests + actions))
 				else:
-					draw = Node(np.random.choice(actions))
+					draw = Node(self._rng.choice(actions))
 				try:
 					tree_tests[0].next_free = draw
 					if draw.is_test:
@@ -84,65 +179,118 @@ class GeneticProgrammer:
 		"""
 		Executes the genetic program.
 
-		:param max_iter: max number of generations in the execution.
+		:param max_iter: max number of generations in the execution. Optional if termination is given.
 		:param level: The level to be tested in the fitness function.
+
+		:type recorder: history.RunRecorder
+		:param recorder: optional recorder of the fitness, size and depth of every individual at each generation.
+
+		:type memory: memory.MemoryMonitor
+		:param memory: optional monitor of the memory used by the population, which may tighten
+			max_depth and simplify deep individuals, or stop the execution when over its budget.
+			Its tracing is stopped when the execution ends.
+
+		:type termination: termination.Criterion
+		:param termination: optional criterion to stop the execution earlier. Combined with max_iter,
+			the execution stops as soon as either is met. The reason is available at stop_reason.
 		:return: the best individual (solution) found to the problem.
 		"""
-		iteration = 0
+		criteria = []
+		if 'max_iter' in kwargs:
+			criteria += [MaxGenerations(kwargs['max_iter'])]
+		if kwargs.get('termination', None) is not None:
+			criteria += [kwargs['termination']]
+		if len(criteria) == 0:
+			raise KeyError('Either max_iter or termination must be given!')
+		termination = AnyOf(*criteria)
+		termination.start()
+
+		state = RunState()
+		self._run_state = state
+		first_evaluation = Tree.n_evaluations
+		recorder = kwargs.get('recorder', None)
+		memory = kwargs.get('memory', None)
 
-		max_iter = kwargs['max_iter']
 		population = self.__sample__(kwargs['level'])
 
-		while iteration < max_iter:
+		while True:
+			Tree.evaluate_batch(population, self._evaluator)  # scores individuals changed in the last generation
 			population = sorted(population, key=lambda x: x.fitness, reverse=True)  # sorts population
+
+			if recorder is not None:
+				recorder.record(state.generation, population)
+
+			state.best_fitness = population[0].fitness
+			state.evaluations = Tree.n_evaluations - first_evaluation
+			self._stop_reason = termination.check(state)
+			if self._stop_reason is None and memory is not None:
+				self._stop_reason = memory.check(state.generation, population, self)
+			if self._stop_reason is not None:
+				break
+
 			n_elite = int(round(self._elitism_rate * self._n_individuals))  # number of elite individuals
 
 			elite = population[:n_elite] if n_elite > 0 else []
 			not_elite = population[n_elite:] if n_elite > 0 else population
 
-			do_crossover = np.random.choice([True, False], p=[self._crossover_prob, 1. - self._crossover_prob])
-			do_mutation = np.random.choice([True, False], p=[self._mutation_prob, 1. - self._mutation_prob])
+			do_crossover = self._rng.choice([True, False], p=[self._crossover_prob, 1. - self._crossover_prob])
+			do_mutation = self._rng.choice([True, False], p=[self._mutation_prob, 1. - self._mutation_prob])
 
-			if do_crossover:
-				GeneticProgrammer.tournament(population, self._tournament_size)
+			if do_crossover:  # offspring take the place of the individuals out of the elite
+				not_elite = GeneticProgrammer.tournament(population, self._tournament_size, self._rng, self._max_depth)[:len(not_elite)]
 
 			if do_mutation:
-				GeneticProgrammer.mutation(self._mutation_rate, not_elite)
+				GeneticProgrammer.mutation(self._mutation_rate, not_elite, self._rng, self._library, self._max_depth)
 
 			population = elite + not_elite
-			iteration += 1
+			state.generation += 1
+
+		if memory is not None:
+			memory.stop()
 
 		return sorted(population, key=lambda x: x.fitness, reverse=True)[0]  # returns the fittest individual
 
 	@staticmethod
-	def tournament(sample, tournament_size):
+	def tournament(sample, tournament_size, rng, max_depth=None):
 		"""
-		Performs a tournament based on the sample given and a tournament size.
+		Performs a tournament based on the sample given and a tournament size. Crossover is
+		performed upon copies of the parents, so the sample is left untouched and every
+		tournament ranks unchanged individuals.
 
 		:param sample: The sample to participate in the tournament. Every individual will
 			be selected sooner or later.
 		:param tournament_size: The size of the tournament.
+		:type rng: numpy.random.RandomState
+		:param rng: The random stream to draw from.
+		:param max_depth: Optional maximum depth of the offspring.
+		:return: As many offspring as individuals in the sample. Their fitness is calculated
+			by the next call to Tree.evaluate_batch.
 		"""
-		taken = []
-		while len(taken) < len(sample):
-			fathers = []
+		offspring = []
+		while len(offspring) < len(sample):
+			children = []
 			for i in range(2):  # two parents for each crossover
-				tournament = np.random.choice(sample, size=tournament_size)
+				tournament = rng.choice(sample, size=tournament_size)
 				father = sorted(tournament, key=lambda x: x.fitness, reverse=True)[0]  # fittest individual is the parent
-				taken += [father]
-				fathers += [father]
-			Tree.crossover(*fathers)
+				children += [father.copy()]
+			Tree.crossover(children[0], children[1], rng, max_depth)
+			offspring += children
+		return offspring[:len(sample)]
 
 	@staticmethod
-	def mutation(mutation_rate, sample):
+	def mutation(mutation_rate, sample, rng, library=None, max_depth=None):
 		"""
 		Performs mutation in the given sample.
 
 		:param mutation_rate: The rate of the sample to mutate.
 		:param sample: The individuals to suffer mutation.
+		:type rng: numpy.random.RandomState
+		:param rng: The random stream to draw from.
+		:param library: Optional library of minimal trees to draw subtrees from.
+		:param max_depth: Optional maximum depth of the mutated individuals.
 		"""
 
 		n_to_mutate = int(round(mutation_rate * len(sample)))
-		to_mutate = np.random.choice(sample, size=n_to_mutate)
+		to_mutate = rng.choice(sample, size=n_to_mutate)
 		for individual in to_mutate:
-			individual.mutate()
+			individual.mutate(rng, library, max_depth)
@@ -0,0 +1,190 @@
+"""
+This file stands for the run history of the genetic
+programmer. A RunRecorder appends per-generation arrays
+(fitness, tree sizes and depths of every individual, and
+optionally the pickled elite) to fixed-width binary column
+files, plus a small index with one record per generation.
+A RunHistory memory-maps those files, so analyses only
+read the generations they touch.
+"""
+
+import os
+import cPickle as pickle
+
+import numpy as np
+
+# one record per generation: generation, first row, number of rows, elite offset, elite length
+INDEX_DTYPE = np.dtype([
+	('generation', '<i8'), ('row', '<i8'), ('count', '<i8'), ('elite_offset', '<i8'), ('elite_length', '<i8')
+])
+
+COLUMNS = {
+	'fitness': np.dtype('<f8'),
+	'size': np.dtype('<i4'),
+	'depth': np.dtype('<i4'),
+}
+
+
+class RunRecorder(object):
+	_directory = None
+	_n_elites = 0
+	_files = None
+	_index = None
+	_rows = 0
+	_elite_bytes = 0
+
+	def __init__(self, directory, n_elites=0):
+		"""
+		Opens (or resumes) the history stored in the given directory. Generations left
+		incomplete by a crash are discarded.
+
+		:param directory: Directory of the column files. Created if needed.
+		:param n_elites: Number of the fittest individuals to pickle at each generation.
+			Defaults to 0 (no elites are stored).
+		"""
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+		self._directory = directory
+		self._n_elites = n_elites
+		self._recover()
+
+		self._files = dict(
+			(name, open(os.path.join(directory, name + '.bin'), 'ab')) for name in COLUMNS
+		)
+		self._elites = open(os.path.join(directory, 'elites.bin'), 'ab')
+		self._index = open(os.path.join(directory, 'index.bin'), 'ab')
+
+	def _recover(self):
+		"""
+		Truncates every file to the last generation completely written, so a history left
+		by a run that crashed in the middle of record is resumed with its columns aligned.
+		"""
+		paths = dict((name, os.path.join(self._directory, name + '.bin')) for name in COLUMNS.keys() + ['elites', 'index'])
+		sizes = dict((name, os.path.getsize(path) if os.path.exists(path) else 0) for name, path in paths.items())
+
+		n_records = sizes['index'] // INDEX_DTYPE.itemsize
+		index = np.fromfile(paths['index'], dtype=INDEX_DTYPE, count=n_records) if n_records > 0 else np.empty(0, dtype=INDEX_DTYPE)
+
+		# drops the last records while any of the files they point to is incomplete
+		while n_records > 0:
+			last = index[n_records - 1]
+			rows = int(last['row'] + last['count'])
+			if all(sizes[name] >= rows * dtype.itemsize for name, dtype in COLUMNS.items()) and \
+					sizes['elites'] >= last['elite_offset'] + last['elite_length']:
+				break
+			n_records -= 1
+
+		self._rows, self._elite_bytes = 0, 0
+		if n_records > 0:
+			last = index[n_records - 1]
+			self._rows = int(last['row'] + last['count'])
+			self._elite_bytes = int(last['elite_offset'] + last['elite_length'])
+
+		lengths = dict((name, self._rows * dtype.itemsize) for name, dtype in COLUMNS.items())
+		lengths['elites'] = self._elite_bytes
+		lengths['index'] = n_records * INDEX_DTYPE.itemsize
+		for name, length in lengths.items():
+			if sizes[name] > length:
+				with open(paths[name], 'r+b') as f:
+					f.truncate(length)
+
+	def record(self, generation, population):
+		"""
+		Appends a generation to the history.
+
+		:param generation: Number of the generation.
+		:param population: Individuals of the generation, sorted from the fittest to the least fit.
+		"""
+		columns = {
+			'fitness': [individual.fitness for individual in population],
+			'size': [len(individual.nodes) for individual in population],
+			'depth': [individual.depth for individual in population],
+		}
+		for name, dtype in COLUMNS.items():
+			np.asarray(columns[name], dtype=dtype).tofile(self._files[name])
+
+		elite_length = 0
+		if self._n_elites > 0:
+			elite = pickle.dumps([individual._root for individual in population[:self._n_elites]], pickle.HIGHEST_PROTOCOL)
+			self._elites.write(elite)
+			elite_length = len(elite)
+
+		record = np.array([(generation, self._rows, len(population), self._elite_bytes, elite_length)], dtype=INDEX_DTYPE)
+		record.tofile(self._index)
+
+		self._rows += len(population)
+		self._elite_bytes += elite_length
+
+		for f in self._files.values() + [self._elites, self._index]:
+			f.flush()  # a crashed run keeps every finished generation
+
+	def close(self):
+		for f in self._files.values() + [self._elites, self._index]:
+			f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+class RunHistory(object):
+	_directory = None
+	_index = None
+	_columns = None
+
+	def __init__(self, directory):
+		"""
+		Memory-maps the history stored in the given directory.
+		"""
+		self._directory = directory
+		self._index = np.fromfile(os.path.join(directory, 'index.bin'), dtype=INDEX_DTYPE)
+
+		self._columns = {}
+		for name, dtype in COLUMNS.items():
+			path = os.path.join(directory, name + '.bin')
+			if os.path.getsize(path) > 0:
+				self._columns[name] = np.memmap(path, dtype=dtype, mode='r')
+			else:
+				self._columns[name] = np.empty(0, dtype=dtype)
+
+	def __len__(self):
+		return len(self._index)
+
+	@property
+	def generations(self):
+		return self._index['generation']
+
+	def column(self, name, i):
+		"""
+		:param name: One of 'fitness', 'size' or 'depth'.
+		:param i: Position of the generation in the history.
+		:return: The values of the given column for every individual of the generation, as a view of the file.
+		"""
+		record = self._index[i]
+		return self._columns[name][record['row']:record['row'] + record['count']]
+
+	def elites(self, i):
+		"""
+		:param i: Position of the generation in the history.
+		:return: The root nodes of the elite stored for the generation.
+		"""
+		record = self._index[i]
+		with open(os.path.join(self._directory, 'elites.bin'), 'rb') as f:
+			f.seek(record['elite_offset'])
+			return pickle.loads(f.read(record['elite_length']))
+
+	def convergence(self, name='fitness'):
+		"""
+		Computes the convergence curve of a column, one generation at a time.
+
+		:return: A structured array with the generation and the best, mean and median
+			value of the column at each generation.
+		"""
+		curve = np.empty(len(self), dtype=[('generation', '<i8'), ('best', '<f8'), ('mean', '<f8'), ('median', '<f8')])
+		for i in xrange(len(self)):
+			values = self.column(name, i)
+			curve[i] = (self._index[i]['generation'], values.max(), values.mean(), np.median(values))
+		return curve
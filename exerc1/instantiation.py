@@ -141,10 +141,7 @@ class Tests(Enum):
 
 
 class Node(object):
-	_test = None
-	_positive = None
-	_negative = None
-	_father = None
+	__slots__ = ('_test', '_positive', '_negative', '_father')  # no per-node __dict__
 
 	def __init__(self, value, father=None, positive=None, negative=None):
 		"""
@@ -293,6 +290,10 @@ class Tree(object):
 	_root = None
 	_fitness = -1.
 	_level = None
+	_dirty = True
+
+	n_evaluations = 0  # fitness evaluations performed by all trees
+	n_invalidations = 0  # evaluations an eager fitness would have performed
 
 	def __init__(self, root, level):
 		"""
@@ -302,11 +303,17 @@ class Tree(object):
 		self._root = root
 		self._level = level
 
-		self.calculate_fitness()
+		self.invalidate()
 
 	def __str__(self):
 		return str(self.fitness)
 
+	def copy(self):
+		"""
+		:return: A copy of this tree, with nodes of its own but the same level. The fitness is copied too.
+		"""
+		return copy.deepcopy(self, {id(self._level): self._level})
+
 	@property
 	def nodes(self):
 		return self._root.nodes_below()
@@ -317,16 +324,79 @@ class Tree(object):
 
 	@property
 	def fitness(self):
+		if self._dirty:
+			self.calculate_fitness()
 		return self._fitness
 
 	@fitness.setter
 	def fitness(self, value):
 		self._fitness = value
+		self._dirty = False
+
+	@property
+	def is_dirty(self):
+		"""
+		:return: True if this tree changed since its fitness was last calculated.
+		"""
+		return self._dirty
+
+	def invalidate(self):
+		"""
+		Marks the fitness of this tree as outdated. It will be calculated
+		only when read, or by the next call to evaluate_batch.
+		"""
+		self._dirty = True
+		Tree.n_invalidations += 1
 
 	def calculate_fitness(self):
 		"""
 		Calculates the fitness of this individual, setting its attribute.
 		"""
+		Tree.n_evaluations += 1
+		if kernels.backend == 'numba':
+			self._fitness = kernels.calculate_fitness(self._root, self._level)
+		else:
+			self._fitness = self.behave_level()
+		self._dirty = False
+
+	@staticmethod
+	def evaluate_batch(trees, evaluator=None):
+		"""
+		Calculates the fitness of every dirty tree in a single call.
+
+		:param trees: The trees to evaluate. Clean trees are skipped.
+		:param evaluator: Optional callable receiving a list of trees and returning
+			their fitness values (e.g. vectorized, cached or parallel). If not given,
+			trees are evaluated one by one.
+		:return: The number of trees evaluated.
+		"""
+		dirty = [tree for tree in trees if tree.is_dirty]
+		if len(dirty) == 0:
+			return 0
+
+		if evaluator is None:
+			for tree in dirty:
+				tree.calculate_fitness()
+		else:
+			for tree, fitness in itertools.izip(dirty, evaluator(dirty)):
+				tree.fitness = fitness
+			Tree.n_evaluations += len(dirty)
+		return len(dirty)
+
+	@staticmethod
+	def evaluations_avoided():
+		"""
+		:return: How many fitness evaluations laziness saved so far, compared to
+			evaluating trees upon creation and after every change.
+		"""
+		return Tree.n_invalidations - Tree.n_evaluations
+
+	def behave_level(self):
+		"""
+		Pure Python evaluation of this individual upon its level.
+
+		:return: The fitness of this individual.
+		"""
 		summation = 0
 		for tile in self._level:
 			result = self._root.behave(tile)
@@ -334,36 +404,118 @@ class Tree(object):
 				break  # fails to solve the problem
 			else:
 				summation += result
-		self._fitness = float(summation) / len(self._level)
-		# z = 0
+		return float(summation) / len(self._level)
 
-	def mutate(self):
+	def mutate(self, rng, library=None, max_depth=None):
 		"""
 		Mutates this tree.
+
+		:type rng: numpy.random.RandomState
+		:param rng: The random stream to draw from.
+		:type library: library.TreeLibrary
+		:param library: optional library of minimal trees. If given, half of the mutations
+			replace a random subtree with a tree from the library instead of changing a node.
+		:param max_depth: Optional maximum depth of the mutated tree.
 		"""
-		all_nodes_of_tree = self._root.nodes_below()
-		random_node = np.random.choice(all_nodes_of_tree)
-		node_type = Actions if random_node.test in Actions else Tests
-		new_value = np.random.choice(node_type.__members__.values())
-		random_node._test = new_value
+		if library is not None and rng.random_sample() < 0.5:
+			self.swap_from_library(library, rng, max_depth)
+		else:
+			all_nodes_of_tree = self._root.nodes_below()
+			random_node = rng.choice(all_nodes_of_tree)
+			node_type = Actions if random_node.test in Actions else Tests
+			new_value = rng.choice(node_type.__members__.values())
+			random_node._test = new_value
 
-		self.calculate_fitness()
+		self.invalidate()
+
+	def swap_from_library(self, library, rng, max_depth=None):
+		"""
+		Replaces a random subtree (other than the root) with a tree from the library: either
+		the smallest tree with the same behaviour, or one whose behaviour differs upon a
+		single tile.
+
+		:type library: library.TreeLibrary
+		:type rng: numpy.random.RandomState
+		:param max_depth: Optional maximum depth of the tree. If the new subtree would make
+			the tree deeper, the swap is undone.
+		"""
+		candidates = [node for node in self._root.nodes_below() if node.father is not None]
+		if len(candidates) == 0:
+			return
+
+		node = rng.choice(candidates)
+		own = library.behaviour(node)
+		if rng.random_sample() < 0.5:
+			index = own  # equivalent, smaller subtree
+		else:
+			index = rng.choice(library.neighbours(own))
+
+		new_node = library.tree(index)
+		father = node.father
+		if father._positive is node:
+			father._positive = new_node
+		else:
+			father._negative = new_node
+		new_node._father = father
+		node._father = None
+
+		if max_depth is not None and self.depth > max_depth:
+			if father._positive is new_node:
+				father._positive = node
+			else:
+				father._negative = node
+			node._father = father
+
+	def simplify(self, library):
+		"""
+		Replaces this tree with the smallest tree of the library with the same behaviour, if
+		smaller. The fitness depends only on the behaviour, so it is kept.
+
+		:type library: library.TreeLibrary
+		:return: True if the tree was replaced.
+		"""
+		root = library.tree(library.behaviour(self._root), test_root=True)
+		if len(root.nodes_below()) >= len(self.nodes):
+			return False
+
+		self._root = root
+		return True
 
 	@staticmethod
-	def crossover(a, b):
+	def crossover(a, b, rng, max_depth=None):
 		"""
 		Performs crossover between two trees a and b.
+
+		:type rng: numpy.random.RandomState
+		:param rng: The random stream to draw from.
+		:param max_depth: Optional maximum depth of the offspring. If either offspring
+			would be deeper, the crossover is undone.
 		"""
-		node_a = np.random.choice(a._root.nodes_below())  # randomly gets a node in the A tree
-		node_b = np.random.choice(b._root.nodes_below())  # randomly gets a node in the B tree
+		node_a = rng.choice(a._root.nodes_below())  # randomly gets a node in the A tree
+		node_b = rng.choice(b._root.nodes_below())  # randomly gets a node in the B tree
 
 		# prevents the root from being selected
 		while node_a.father is None:
-			node_a = np.random.choice(a._root.nodes_below())  # randomly gets a node in the A tree
+			node_a = rng.choice(a._root.nodes_below())  # randomly gets a node in the A tree
 
 		while node_b.father is None:
-			node_b = np.random.choice(b._root.nodes_below())  # randomly gets a node in the B tree
+			node_b = rng.choice(b._root.nodes_below())  # randomly gets a node in the B tree
+
+		Tree.swap(node_a, node_b)
+
+		if max_depth is not None and max(a.depth, b.depth) > max_depth:
+			Tree.swap(node_a, node_b)  # swapping again restores both parents
+			return
 
+		# fitness is recalculated lazily
+		a.invalidate()
+		b.invalidate()
+
+	@staticmethod
+	def swap(node_a, node_b):
+		"""
+		Swaps two subtrees, given their (non-root) root nodes.
+		"""
 		node_a_father = node_a._father  # father of A node
 		node_b_father = node_b._father  # father of B node
 
@@ -382,10 +534,6 @@ class Tree(object):
 		node_b._father = node_a_father
 		node_a._father = node_b_father
 
-		# recalculates fitness
-		a.calculate_fitness()
-		b.calculate_fitness()
-
 	def plot(self):
 		"""
 		Plots this tree using matplotlib and networkx.
@@ -415,3 +563,6 @@ class Tree(object):
 		nx_edge_labels = nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels, font_size=16)
 		nx.draw(G, pos, labels=node_labels, edge_labels=nx_edge_labels)
 		plt.draw()
+
+
+import kernels  # imported last, since kernels depends on the classes above
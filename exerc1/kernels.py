@@ -0,0 +1,157 @@
+"""
+This file stands for the compiled evaluation kernel of
+the fitness function. Trees are flattened into opcode
+arrays, and the per-tile loop is compiled with Numba when
+it is installed. Otherwise, Tree falls back to its pure
+Python evaluation.
+
+Running this file checks the pure Python evaluation against
+reference values, checks that the kernel agrees with it (run
+as plain Python, and compiled when Numba is installed) and
+reports the speedup of the compiled kernel.
+"""
+
+try:
+	import numba
+	backend = 'numba'
+except ImportError:
+	numba = None
+	backend = 'python'
+
+import numpy as np
+
+from instantiation import Adversities, Tests, Actions
+
+# opcodes below len(tile_codes) are tests (tile == opcode); the remaining are actions
+tile_codes = {Adversities.plain.value: 0, Adversities.hole.value: 1, Adversities.enemy.value: 2}
+test_opcodes = {Tests.is_plain: 0, Tests.is_hole: 1, Tests.is_enemy: 2}
+action_opcodes = {Actions.move_right: 3, Actions.jump: 4, Actions.fire: 5}
+
+# success[opcode - 3, tile]: whether an action is adequate upon a tile
+success = np.array([
+	[Actions.run(action, tile) for tile in sorted(tile_codes, key=tile_codes.get)]
+	for action in sorted(action_opcodes, key=action_opcodes.get)
+], dtype=np.int8)
+
+_last_level = (None, None)
+
+
+def encode_tree(root):
+	"""
+	Flattens a tree into opcode arrays, in the same order as Node.nodes_below.
+
+	:param root: Root node of the tree.
+	:return: opcodes, positive and negative children indexes (-1 for actions).
+	"""
+	nodes = root.nodes_below()
+	index = dict((id(node), i) for i, node in enumerate(nodes))
+
+	opcodes = np.empty(len(nodes), dtype=np.int8)
+	positive = np.full(len(nodes), -1, dtype=np.int32)
+	negative = np.full(len(nodes), -1, dtype=np.int32)
+
+	for i, node in enumerate(nodes):
+		if node.is_test:
+			opcodes[i] = test_opcodes[node.test]
+			positive[i] = index[id(node.positive)]
+			negative[i] = index[id(node.negative)]
+		else:
+			opcodes[i] = action_opcodes[node.test]
+
+	return opcodes, positive, negative
+
+
+def encode_level(level):
+	"""
+	:param level: A list of tiles.
+	:return: The tile codes of the level. The last level encoded is cached.
+	"""
+	global _last_level
+	if _last_level[0] is not level:
+		_last_level = (level, np.array([tile_codes[tile] for tile in level], dtype=np.int8))
+	return _last_level[1]
+
+
+def clear_cache():
+	"""
+	Drops the cached tile codes of the last level encoded.
+	"""
+	global _last_level
+	_last_level = (None, None)
+
+
+def jit(function):
+	"""
+	Compiles the given function with Numba, if available.
+	"""
+	if backend == 'numba':
+		return numba.njit(cache=True)(function)
+	return function
+
+
+@jit
+def evaluate(opcodes, positive, negative, level, success):
+	"""
+	Evaluates a flattened tree upon a level. Mirrors Tree.calculate_fitness.
+
+	:param level: tile codes of the level.
+	:return: The fitness of the tree.
+	"""
+	summation = 0
+	for tile in level:
+		node = 0
+		while opcodes[node] < 3:
+			if tile == opcodes[node]:
+				node = positive[node]
+			else:
+				node = negative[node]
+		if not success[opcodes[node] - 3, tile]:
+			break  # fails to solve the problem
+		summation += 1
+	return float(summation) / len(level)
+
+
+def calculate_fitness(root, level):
+	"""
+	Calculates the fitness of the tree rooted at the given node with the compiled kernel.
+	"""
+	opcodes, positive, negative = encode_tree(root)
+	return evaluate(opcodes, positive, negative, encode_level(level), success)
+
+
+if __name__ == '__main__':
+	import time
+	from genetic_programming import GeneticProgrammer
+
+	# tiles solved by every 25th individual of the check (from the 6th on), as evaluated by Tree.behave_level
+	reference = [24, 14, 2000, 2000, 2000, 24, 2000, 24, 2000, 2000, 14, 24, 24, 24, 2000, 14, 24, 24, 24, 24]
+
+	rng = np.random.RandomState(0)
+
+	level = list(rng.choice(sorted(tile_codes), size=2000, p=[0.1, 0.1, 0.8]))
+	population = GeneticProgrammer(n_individuals=500, max_initial_height=6, rng=rng).__sample__(level)
+	encoded = [encode_tree(individual._root) for individual in population]
+
+	def run_kernel(kernel):
+		return [float(kernel(opcodes, positive, negative, encode_level(level), success)) for opcodes, positive, negative in encoded]
+
+	began = time.time()
+	expected = [individual.behave_level() for individual in population]
+	python_time = time.time() - began
+
+	assert [int(round(fitness * len(level))) for fitness in expected[5::25]] == reference, 'Python evaluation disagrees with the reference'
+	assert run_kernel(getattr(evaluate, 'py_func', evaluate)) == expected, 'uncompiled kernel disagrees'
+	print('Python evaluation and uncompiled kernel agree on %d individuals' % len(expected))
+
+	if backend != 'numba':
+		print('Numba is not installed; the compiled kernel was not checked.')
+	else:
+		run_kernel(evaluate)  # compiles the kernel
+
+		began = time.time()
+		obtained = run_kernel(evaluate)
+		numba_time = time.time() - began
+
+		assert obtained == expected, 'compiled kernel disagrees'
+		print('Compiled kernel agrees on %d individuals' % len(expected))
+		print('Python %.3fs, Numba %.3fs, speedup %.1fx' % (python_time, numba_time, python_time / numba_time))
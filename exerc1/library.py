@@ -0,0 +1,192 @@
+"""
+This file stands for the library of minimal trees. The
+behaviour of a tree is the action it takes upon each kind
+of tile; there are only 3 ** 3 of them. The library maps
+every behaviour to the smallest tree showing it, and is
+stored as a compact file built offline by running this
+file. Trees are stored in prefix order (node, positive
+branch, negative branch) with the opcodes of kernels.
+"""
+
+import os
+
+from instantiation import Node, Tests, Actions
+from kernels import tile_codes, test_opcodes, action_opcodes
+
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'library.bin')
+
+tiles = sorted(tile_codes, key=tile_codes.get)
+actions = sorted(action_opcodes, key=action_opcodes.get)
+opcode_values = dict((opcode, value) for value, opcode in test_opcodes.items() + action_opcodes.items())
+
+N_BEHAVIOURS = len(actions) ** len(tiles)
+
+_loaded = None
+
+
+def decide(node, tile):
+	"""
+	:return: The action the tree rooted at the given node takes upon the given tile.
+	"""
+	while node.is_test:
+		node = node.positive if Tests.run(node.test, tile) else node.negative
+	return node.test
+
+
+def behaviour(node):
+	"""
+	:return: The behaviour of the tree rooted at the given node, as an integer in [0, N_BEHAVIOURS).
+	"""
+	return sum(actions.index(decide(node, tile)) * len(actions) ** i for i, tile in enumerate(tiles))
+
+
+def behaviour_actions(index):
+	"""
+	:return: The action of the given behaviour upon each tile, in the order of tiles.
+	"""
+	return [actions[(index // len(actions) ** i) % len(actions)] for i in xrange(len(tiles))]
+
+
+def encode(node):
+	"""
+	:return: The opcodes of the tree rooted at the given node, in prefix order.
+	"""
+	if node.is_action:
+		return [action_opcodes[node.test]]
+	return [test_opcodes[node.test]] + encode(node.positive) + encode(node.negative)
+
+
+def decode(opcodes):
+	"""
+	:return: A new tree built from opcodes in prefix order.
+	"""
+	def build(i):
+		value = opcode_values[opcodes[i]]
+		if value in Actions:
+			return Node(value), i + 1
+		positive, i = build(i + 1)
+		negative, i = build(i)
+		return Node(value, positive=positive, negative=negative), i
+
+	return build(0)[0]
+
+
+class TreeLibrary(object):
+	_trees = None
+
+	def __init__(self, trees):
+		"""
+		:param trees: Dictionary from behaviours to the opcodes of their smallest known tree.
+		"""
+		self._trees = trees
+
+	@staticmethod
+	def build():
+		"""
+		Enumerates trees by increasing size until every behaviour is found.
+		"""
+		by_size = {1: [[action_opcodes[action]] for action in actions]}
+		trees = {}
+		size = 1
+		while len(trees) < N_BEHAVIOURS:
+			if size not in by_size:
+				by_size[size] = [
+					[test_opcodes[test]] + positive + negative
+					for test in sorted(test_opcodes, key=test_opcodes.get)
+					for positive_size in xrange(1, size - 1, 2)
+					for positive in by_size[positive_size]
+					for negative in by_size[size - 1 - positive_size]
+				]
+			for opcodes in by_size[size]:
+				trees.setdefault(behaviour(decode(opcodes)), opcodes)
+			size += 2
+
+		return TreeLibrary(trees)
+
+	@staticmethod
+	def load(path=LIBRARY_PATH):
+		"""
+		Loads a library saved with save. The library is built if the file does not exist.
+		"""
+		if not os.path.exists(path):
+			return TreeLibrary.build()
+
+		with open(path, 'rb') as f:
+			data = bytearray(f.read())
+
+		trees = {}
+		i = 0
+		for index in xrange(N_BEHAVIOURS):
+			length = data[i]
+			if length > 0:
+				trees[index] = list(data[i + 1:i + 1 + length])
+			i += 1 + length
+		return TreeLibrary(trees)
+
+	def save(self, path=LIBRARY_PATH):
+		"""
+		Saves the library as, for each behaviour, the length of its tree followed by its opcodes.
+		"""
+		data = bytearray()
+		for index in xrange(N_BEHAVIOURS):
+			opcodes = self._trees.get(index, [])
+			data.append(len(opcodes))
+			data.extend(opcodes)
+
+		with open(path, 'wb') as f:
+			f.write(data)
+
+	@staticmethod
+	def behaviour(node):
+		"""
+		:return: The behaviour of the tree rooted at the given node.
+		"""
+		return behaviour(node)
+
+	@property
+	def behaviours(self):
+		return sorted(self._trees.keys())
+
+	def size(self, index):
+		"""
+		:return: The size of the smallest known tree of the given behaviour.
+		"""
+		return len(self._trees[index])
+
+	def tree(self, index, test_root=False):
+		"""
+		:param index: A behaviour.
+		:param test_root: If True, a single action is wrapped in a test with both branches
+			taking that action, since crossover needs trees with a test at the root.
+		:return: A new copy of the smallest known tree of the given behaviour.
+		"""
+		root = decode(self._trees[index])
+		if test_root and root.is_action:
+			root = Node(Tests.is_plain, positive=root, negative=Node(root.test))
+		return root
+
+	def neighbours(self, index):
+		"""
+		:return: The behaviours that differ from the given one upon a single tile.
+		"""
+		own = behaviour_actions(index)
+		return [
+			other for other in self.behaviours
+			if sum(a != b for a, b in zip(own, behaviour_actions(other))) == 1
+		]
+
+
+def load():
+	"""
+	:return: The library stored at LIBRARY_PATH, loaded once.
+	"""
+	global _loaded
+	if _loaded is None:
+		_loaded = TreeLibrary.load()
+	return _loaded
+
+
+if __name__ == '__main__':
+	library = TreeLibrary.build()
+	library.save()
+	print 'Saved %d behaviours to %s' % (len(library.behaviours), LIBRARY_PATH)
@@ -0,0 +1,190 @@
+"""
+This file stands for the memory accounting of the genetic
+programmer. A MemoryMonitor measures the population at each
+generation (node counts and an estimate of its size in
+bytes), optionally takes snapshots, and enforces a memory
+budget: a generation over budget tightens the maximum tree
+depth and simplifies the individuals deeper than it, and a
+second one in a row stops the run cleanly with a checkpoint.
+
+Snapshots come from tracemalloc when it is available (the
+pytracemalloc package on Python 2). Otherwise they hold the
+resident memory of the process and a census of the objects
+tracked by the garbage collector.
+"""
+
+import gc
+import os
+import sys
+import cPickle as pickle
+
+try:
+	import tracemalloc  # stdlib on Python 3; the pytracemalloc package on Python 2
+except ImportError:
+	tracemalloc = None
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+import numpy as np
+
+import library as tree_library
+
+TIGHTEN_LIMITS, STOP = range(2)
+
+
+def population_bytes(population):
+	"""
+	Estimates the memory held by a population.
+
+	:return: The number of nodes in the population and its estimated size in bytes.
+	"""
+	if len(population) == 0:
+		return 0, 0
+
+	n_nodes = sum(len(individual.nodes) for individual in population)
+	node_bytes = sys.getsizeof(population[0]._root)  # Node has __slots__, so there is no per-node __dict__
+	tree_bytes = sys.getsizeof(population[0]) + sys.getsizeof(population[0].__dict__)
+	return n_nodes, n_nodes * node_bytes + len(population) * tree_bytes
+
+
+def resident_bytes():
+	"""
+	:return: The resident memory of the process, in bytes. Its peak is returned instead where
+		/proc is not available.
+	"""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (IOError, OSError, ValueError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # in kilobytes on Linux
+
+
+def object_census(top):
+	"""
+	Counts the objects tracked by the garbage collector (containers and instances) by type.
+
+	:param top: Number of types kept.
+	:return: The most common types, as 'name: count' strings.
+	"""
+	counts = {}
+	for obj in gc.get_objects():
+		name = type(obj).__name__
+		counts[name] = counts.get(name, 0) + 1
+	return ['%s: %d' % (name, count) for name, count in sorted(counts.items(), key=lambda item: -item[1])[:top]]
+
+
+class MemoryMonitor(object):
+	_budget = None
+	_snapshots = False
+	_top = 10
+	_checkpoint = None
+	_stage = TIGHTEN_LIMITS
+	_report = None
+	_tracing = False
+
+	def __init__(self, budget=None, snapshots=False, top=10, checkpoint=None):
+		"""
+		:param budget: Optional memory budget, in bytes. Compared to the memory traced by
+			tracemalloc (or to the resident memory of the process without it) when snapshots are
+			taken, or to the estimated size of the population otherwise.
+		:param snapshots: If True, takes a snapshot at every generation: tracemalloc traces
+			allocations from now on and its top allocation sites are kept or, without tracemalloc,
+			the most common types of objects.
+		:param top: Number of allocation sites (or types) kept from each snapshot.
+		:param checkpoint: Optional path to pickle the population to when the run is stopped.
+		"""
+		if snapshots and tracemalloc is None and resource is None:
+			raise ImportError('neither tracemalloc nor resource is available!')
+
+		self._budget = budget
+		self._snapshots = snapshots
+		self._top = top
+		self._checkpoint = checkpoint
+		self._stage = TIGHTEN_LIMITS
+		self._report = []
+
+		if snapshots:
+			self.trace()
+
+	@property
+	def report(self):
+		"""
+		:return: One dictionary per generation checked, with the node count, the estimated
+			population bytes, the depth of the deepest tree, the traced (or resident) memory and
+			top allocation sites (or types) if snapshots are taken, and the action taken, if any.
+		"""
+		return self._report
+
+	def trace(self):
+		"""
+		Starts tracing allocations, unless they are already traced or tracemalloc is not available.
+		"""
+		if tracemalloc is not None and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._tracing = True
+
+	def check(self, generation, population, gp):
+		"""
+		Measures a generation and enforces the budget. Once usage is back under budget,
+		the next overrun tightens the limits again rather than stopping.
+
+		:param generation: Number of the generation.
+		:param population: Individuals of the generation.
+		:type gp: genetic_programming.GeneticProgrammer
+		:param gp: The genetic programmer running, whose max_depth may be tightened. Deeper
+			individuals are replaced with smaller trees of the same behaviour from its library.
+		:return: The reason to stop the run, or None to keep going.
+		"""
+		n_nodes, estimated = population_bytes(population)
+		depths = [individual.depth for individual in population]
+		entry = {
+			'generation': generation,
+			'nodes': n_nodes,
+			'bytes': estimated,
+			'max_depth': max(depths),
+			'action': None,
+		}
+
+		used = estimated
+		if self._snapshots and tracemalloc is not None:
+			self.trace()  # tracing is stopped at the end of each run
+			entry['traced'] = used = tracemalloc.get_traced_memory()[0]
+			entry['top'] = [str(stat) for stat in tracemalloc.take_snapshot().statistics('lineno')[:self._top]]
+		elif self._snapshots:
+			entry['resident'] = used = resident_bytes()
+			entry['top'] = object_census(self._top)
+
+		self._report += [entry]
+
+		if self._budget is None or used <= self._budget:
+			self._stage = TIGHTEN_LIMITS
+			return None
+
+		if self._stage == TIGHTEN_LIMITS:
+			gp.max_depth = max(2, int(np.median(depths)))
+			library = gp.library if gp.library is not None else tree_library.load()
+			simplified = sum(
+				individual.simplify(library) for individual in population if individual.depth > gp.max_depth
+			)
+			gc.collect()  # nodes point to their fathers, so discarded subtrees are only freed by the collector
+			entry['action'] = 'tightened max_depth to %d and simplified %d individuals' % (gp.max_depth, simplified)
+		else:
+			if self._checkpoint is not None:
+				with open(self._checkpoint, 'wb') as f:
+					pickle.dump({'generation': generation, 'roots': [individual._root for individual in population]}, f, pickle.HIGHEST_PROTOCOL)
+			entry['action'] = 'stopped'
+			return 'exceeded memory budget of %d bytes (%d used)' % (self._budget, used)
+
+		self._stage += 1
+		return None
+
+	def stop(self):
+		"""
+		Stops tracing allocations, if this monitor started it.
+		"""
+		if self._tracing:
+			tracemalloc.stop()
+			self._tracing = False
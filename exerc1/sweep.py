@@ -0,0 +1,196 @@
+"""
+This file stands for the hyperparameter sweep of the
+genetic programmer. Each (configuration, seed) pair is an
+independent call to find_solution, run on a process pool
+sized to the machine. Results are appended to a JSON-lines
+store as soon as each job finishes, and jobs already in the
+store are skipped when the sweep is run again. Jobs are
+keyed by their level and budgets too, so a store may hold
+sweeps upon different levels without mixing them up.
+"""
+
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from genetic_programming import GeneticProgrammer, make_rng, spawn_seeds
+from termination import TargetFitness, MaxWallTime
+
+
+def grid(**values):
+	"""
+	:param values: For each parameter of GeneticProgrammer, the list of values to try.
+	:return: Every combination of the given values, as a list of configurations.
+	"""
+	names = sorted(values.keys())
+	return [dict(itertools.izip(names, combination)) for combination in itertools.product(*[values[name] for name in names])]
+
+
+def random_sample(n_configurations, seed=None, **values):
+	"""
+	:param n_configurations: Number of configurations to draw.
+	:param seed: Seed of the draw.
+	:param values: For each parameter of GeneticProgrammer, the list of values to draw from.
+	:return: A list of n_configurations distinct configurations, drawn at random.
+	"""
+	configurations = grid(**values)
+	drawn = make_rng(seed).choice(len(configurations), size=min(n_configurations, len(configurations)), replace=False)
+	return [configurations[i] for i in drawn]
+
+
+def run_settings(level, max_iter, target, max_time):
+	"""
+	:return: A digest of the arguments shared by every job of a sweep: the level and the budgets.
+	"""
+	return hashlib.sha1(json.dumps([list(level), max_iter, target, max_time])).hexdigest()[:16]
+
+
+def job_key(configuration, seed, settings):
+	"""
+	:param settings: The digest of the level and budgets of the job, as given by run_settings.
+	:return: The key that identifies a job in the store.
+	"""
+	return json.dumps([configuration, seed, settings], sort_keys=True)
+
+
+def run_job(job):
+	"""
+	Runs find_solution for a single configuration and seed.
+
+	:param job: A (configuration, seed, level, max_iter, target, max_time) tuple.
+	:return: A dictionary with the results of the run.
+	"""
+	configuration, seed, level, max_iter, target, max_time = job
+
+	termination = TargetFitness(target)
+	if max_time is not None:
+		termination = termination | MaxWallTime(max_time)
+
+	gp = GeneticProgrammer(seed=seed, **configuration)  # the job draws only from its own stream
+	fittest = gp.find_solution(max_iter=max_iter, level=level, termination=termination)
+	state = gp.run_state
+	elapsed = state.elapsed
+	settings = run_settings(level, max_iter, target, max_time)
+
+	return {
+		'key': job_key(configuration, seed, settings),
+		'configuration': configuration,
+		'seed': seed,
+		'settings': settings,
+		'best_fitness': fittest.fitness,
+		'generations': state.generation,
+		'evaluations': state.evaluations,
+		'elapsed': elapsed,
+		'time_to_target': elapsed if fittest.fitness >= target else None,
+		'stop_reason': gp.stop_reason,
+	}
+
+
+def load(store):
+	"""
+	:param store: Path to a JSON-lines store.
+	:return: The results in the store, or an empty list if it does not exist.
+	"""
+	if not os.path.exists(store):
+		return []
+	with open(store) as f:
+		return [json.loads(line) for line in f if line.strip() != '']
+
+
+def sweep(configurations, seeds, level, store, max_iter=100, target=1., max_time=None, n_processes=None):
+	"""
+	Runs every configuration with every seed, skipping jobs already in the store.
+
+	:param configurations: List of GeneticProgrammer keyword arguments (see grid and random_sample),
+		each including n_individuals.
+	:param seeds: List of seeds to run each configuration with.
+	:param level: The level to be tested in the fitness function.
+	:param store: Path to the JSON-lines store results are appended to.
+	:param max_iter: Max number of generations of each run.
+	:param target: Fitness at which a run stops and counts as successful. Defaults to 1.0.
+	:param max_time: Optional max wall-clock time of each run, in seconds.
+	:param n_processes: Size of the process pool. Defaults to the number of cores.
+	:return: The number of jobs run.
+	"""
+	settings = run_settings(level, max_iter, target, max_time)
+	done = set(result['key'] for result in load(store))
+	jobs = [
+		(configuration, seed, level, max_iter, target, max_time)
+		for configuration in configurations for seed in seeds
+		if job_key(configuration, seed, settings) not in done
+	]
+	if len(jobs) == 0:
+		return 0
+
+	pool = multiprocessing.Pool(n_processes or multiprocessing.cpu_count())
+	try:
+		with open(store, 'a') as f:
+			for result in pool.imap_unordered(run_job, jobs):
+				f.write(json.dumps(result, sort_keys=True) + '\n')
+				f.flush()  # results survive an interrupted sweep
+	finally:
+		pool.close()
+		pool.join()
+
+	return len(jobs)
+
+
+def report(store, settings=None):
+	"""
+	Summarizes the store by configuration, separately for each level and budgets.
+
+	:param store: Path to a JSON-lines store.
+	:param settings: Optional digest given by run_settings. If given, only the jobs run
+		upon those level and budgets are summarized.
+	:return: One dictionary per configuration and settings, with its number of runs, success
+		rate, median time to target (over successful runs) and mean and max best fitness,
+		sorted from the best to the worst configuration.
+	"""
+	by_configuration = {}
+	for result in load(store):
+		if settings is not None and result.get('settings') != settings:
+			continue
+		key = json.dumps([result.get('settings'), result['configuration']], sort_keys=True)
+		by_configuration.setdefault(key, []).append(result)
+
+	rows = []
+	for key, results in by_configuration.items():
+		times = [result['time_to_target'] for result in results if result['time_to_target'] is not None]
+		best = [result['best_fitness'] for result in results]
+		rows += [{
+			'configuration': results[0]['configuration'],
+			'settings': results[0].get('settings'),
+			'runs': len(results),
+			'success_rate': float(len(times)) / len(results),
+			'median_time_to_target': float(np.median(times)) if len(times) > 0 else None,
+			'mean_best_fitness': float(np.mean(best)),
+			'max_best_fitness': max(best),
+		}]
+
+	return sorted(rows, key=lambda x: (
+		-x['success_rate'],
+		x['median_time_to_target'] if x['median_time_to_target'] is not None else float('inf'),
+		-x['mean_best_fitness']
+	))
+
+
+if __name__ == '__main__':
+	level = ['P', 'P', 'P', 'H', 'H', 'P', 'P', 'P', 'H', 'P', 'P', 'P', 'P', 'H', 'P', 'P', 'E', 'E', 'P', 'P']
+
+	configurations = grid(
+		n_individuals=[10, 50],
+		elitism_rate=[0., 0.1],
+		crossover_prob=[0.5, 0.9],
+		tournament_size=[2, 5],
+		mutation_rate=[0.05, 0.2],
+		mutation_prob=[0.03, 0.3],
+		max_initial_height=[3, 5],
+	)
+
+	sweep(configurations, seeds=spawn_seeds(0, 5), level=level, store='sweep.jsonl', max_iter=100, max_time=60.)
+	for row in report('sweep.jsonl', run_settings(level, max_iter=100, target=1., max_time=60.)):
+		print row
@@ -0,0 +1,166 @@
+"""
+This file stands for the termination criteria of the
+genetic programming. A criterion inspects the state of
+the run at the beginning of every generation and tells
+whether (and why) the run should stop.
+"""
+
+import time
+
+
+class RunState(object):
+	"""
+	State of a run, as seen by the termination criteria.
+	"""
+
+	def __init__(self):
+		self.generation = 0
+		self.best_fitness = None
+		self.evaluations = 0
+		self._began = time.time()
+
+	@property
+	def elapsed(self):
+		"""
+		:return: Seconds since the run began.
+		"""
+		return time.time() - self._began
+
+
+class Criterion(object):
+	"""
+	Base class of the termination criteria.
+	"""
+
+	def start(self):
+		"""
+		Resets the criterion for a new run.
+		"""
+		pass
+
+	def check(self, state):
+		"""
+		:type state: RunState
+		:param state: The state of the run at the beginning of a generation.
+		:return: The reason to stop the run, or None to keep going.
+		"""
+		raise NotImplementedError('Subclasses must implement check!')
+
+	def __or__(self, other):
+		return AnyOf(self, other)
+
+	def __and__(self, other):
+		return AllOf(self, other)
+
+
+class MaxGenerations(Criterion):
+	def __init__(self, max_iter):
+		"""
+		:param max_iter: Max number of generations in the execution.
+		"""
+		self.max_iter = max_iter
+
+	def check(self, state):
+		if state.generation >= self.max_iter:
+			return 'reached %d generations' % self.max_iter
+		return None
+
+
+class TargetFitness(Criterion):
+	def __init__(self, target=1.):
+		"""
+		:param target: Fitness to reach. Defaults to 1.0, the maximum fitness.
+		"""
+		self.target = target
+
+	def check(self, state):
+		if state.best_fitness is not None and state.best_fitness >= self.target:
+			return 'reached target fitness %r' % self.target
+		return None
+
+
+class Stagnation(Criterion):
+	_best = None
+	_since = 0
+
+	def __init__(self, n_generations):
+		"""
+		:param n_generations: Number of generations without improvement of the best fitness.
+		"""
+		self.n_generations = n_generations
+
+	def start(self):
+		self._best = None
+		self._since = 0
+
+	def check(self, state):
+		if self._best is None or state.best_fitness > self._best:
+			self._best = state.best_fitness
+			self._since = 0
+		else:
+			self._since += 1
+
+		if self._since >= self.n_generations:
+			return 'no improvement for %d generations' % self.n_generations
+		return None
+
+
+class MaxWallTime(Criterion):
+	def __init__(self, seconds):
+		"""
+		:param seconds: Max wall-clock time of the execution, in seconds.
+		"""
+		self.seconds = seconds
+
+	def check(self, state):
+		if state.elapsed >= self.seconds:
+			return 'exceeded %.1f seconds' % self.seconds
+		return None
+
+
+class MaxEvaluations(Criterion):
+	def __init__(self, max_evaluations):
+		"""
+		:param max_evaluations: Max number of fitness evaluations in the execution.
+		"""
+		self.max_evaluations = max_evaluations
+
+	def check(self, state):
+		if state.evaluations >= self.max_evaluations:
+			return 'exceeded %d fitness evaluations' % self.max_evaluations
+		return None
+
+
+class AnyOf(Criterion):
+	def __init__(self, *criteria):
+		"""
+		Stops as soon as any of the given criteria is met.
+		"""
+		self.criteria = criteria
+
+	def start(self):
+		for criterion in self.criteria:
+			criterion.start()
+
+	def check(self, state):
+		reasons = [criterion.check(state) for criterion in self.criteria]  # every criterion sees every generation
+		reasons = [reason for reason in reasons if reason is not None]
+		return '; '.join(reasons) if len(reasons) > 0 else None
+
+
+class AllOf(Criterion):
+	def __init__(self, *criteria):
+		"""
+		Stops only when all the given criteria are met.
+		"""
+		self.criteria = criteria
+
+	def start(self):
+		for criterion in self.criteria:
+			criterion.start()
+
+	def check(self, state):
+		reasons = [criterion.check(state) for criterion in self.criteria]
+		if any(reason is None for reason in reasons):
+			return None
+		return ' and '.join(reasons)
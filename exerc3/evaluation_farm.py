@@ -0,0 +1,346 @@
+"""evaluation_farm.py
+
+This file stands for the distributed evaluation of the
+fitness function. Worker processes listen on TCP and
+evaluate batches of trees compiled into lookup tables
+(see utils.lookupTable) upon a trajectory bank described
+by its arguments. The EvaluationFarm pools one connection
+per worker, hands batches to whichever worker is free and
+resubmits the batches of workers that fail or hang.
+
+Messages are pickled, so workers only answer drivers that
+know their secret key: set it in the BIOGP_AUTHKEY
+environment variable, then start a worker with
+    python evaluation_farm.py worker <host> <port>
+or check several workers on localhost with
+    python evaluation_farm.py demo <numWorkers>
+"""
+
+from array import array
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import utils
+
+authkeyVariable = "BIOGP_AUTHKEY";
+
+
+def environmentAuthkey():
+    """
+    :return: the secret key of the farm, read from the BIOGP_AUTHKEY environment variable.
+    """
+    authkey = os.environ.get(authkeyVariable, "");
+    if not authkey:
+        raise RuntimeError("Set the secret key of the farm in the %s environment variable" % authkeyVariable);
+    return authkey.encode();
+
+
+def bankKey(bankDescription):
+    """
+    :return: a digest identifying the bank built from the given description.
+    """
+    return hashlib.sha1(json.dumps(bankDescription, sort_keys=True).encode()).hexdigest();
+
+
+def evaluateBatch(bank, batch):
+    """
+    Evaluates a batch of compiled trees.
+
+    :param bank:  the EnemyTrajectoryBank to replay.
+    :param batch: list of (table bytes, depth) pairs.
+    :return:      the mean fitness of each tree over the episodes of the bank.
+    """
+    fitness = [];
+    for tableBytes, depth in batch:
+        table = array('b');
+        table.frombytes(tableBytes);
+        total = 0.;
+        for episode in range(bank.numEpisodes):
+            total += utils.tableFitness(table, depth, bank, episode);
+        fitness.append(total / bank.numEpisodes);
+    return fitness;
+
+
+def serveConnection(connection):
+    """
+    Answers the requests of a driver until it closes the connection.
+    The driver sends each trajectory bank once, then refers to it by key in every batch upon it.
+    """
+    key, bank, failure = None, None, None;
+    try:
+        while True:
+            message = connection.recv();
+            if message[0] == "close":
+                break;
+
+            if message[0] == "bank":
+                kind, key, bankDescription = message;
+                try:
+                    bank, failure = utils.EnemyTrajectoryBank(**bankDescription), None;
+                except Exception as e:
+                    bank, failure = None, e; # reported with the batches upon this bank
+                continue;
+
+            kind, batchId, batchKey, batch = message;
+            try:
+                if batchKey != key:
+                    raise ValueError("Unknown trajectory bank %s" % batchKey);
+                if failure is not None:
+                    raise failure;
+                connection.send(("result", batchId, evaluateBatch(bank, batch)));
+            except Exception as e:
+                connection.send(("error", batchId, repr(e)));
+    except (EOFError, OSError):
+        pass; # driver went away
+    finally:
+        connection.close();
+
+
+def serveWorker(address, authkey):
+    """
+    Listens on the given (host, port) address forever, answering each driver in its own thread.
+
+    :param authkey: secret key shared with the drivers. Required, since requests are unpickled.
+    """
+    if not authkey:
+        raise ValueError("Workers need a secret key");
+    listener = Listener(address, authkey=authkey);
+    print("Worker listening on %s:%i" % listener.address);
+    while True:
+        connection = listener.accept();
+        threading.Thread(target=serveConnection, args=(connection,), daemon=True).start();
+
+
+class EvaluationFarm:
+
+    def __init__(self, addresses, authkey, batchSize=32, timeout=60., retryDelay=30.):
+        """
+        Connects to the given workers.
+
+        :param addresses:  list of (host, port) addresses of running workers.
+        :param authkey:    shared secret of the workers (see environmentAuthkey).
+        :param batchSize:  number of trees sent to a worker at once.
+        :param timeout:    seconds to wait for a worker to connect, or for the result of a batch,
+                           before giving up on the worker and resubmitting the batch to the others.
+        :param retryDelay: seconds to wait before reconnecting to a worker that failed or hung.
+        """
+        if not authkey:
+            raise ValueError("The farm needs the secret key of its workers");
+
+        self.addresses = list(addresses);
+        self.authkey = authkey;
+        self.batchSize = batchSize;
+        self.timeout = timeout;
+        self.retryDelay = retryDelay;
+        self.connections = {};
+        self.banks = {}; # key of the bank last sent through each connection
+        self.retryAt = {}; # when workers that failed or hung may be connected to again
+
+        for address in self.addresses:
+            self.connect(address);
+
+    def connect(self, address):
+        """
+        :return: the pooled connection to the given worker, reconnecting if needed, or None if it
+                 is down or waiting for its retry delay.
+        """
+        if self.connections.get(address) is None:
+            self.banks[address] = None;
+            if time.time() < self.retryAt.get(address, 0.):
+                return None;
+            self.connections[address] = self.open(address);
+            if self.connections[address] is None:
+                self.retryAt[address] = time.time() + self.retryDelay;
+        return self.connections[address];
+
+    def open(self, address):
+        """
+        Connects and authenticates to a worker on a helper thread, since the handshake of a
+        hung worker never ends.
+        :return: the connection, or None if the worker is down or did not answer within the timeout.
+        """
+        lock = threading.Lock();
+        state = {"connection": None, "abandoned": False};
+
+        def handshake():
+            try:
+                connection = Client(address, authkey=self.authkey);
+            except (OSError, EOFError, AuthenticationError):
+                return;
+            with lock:
+                if state["abandoned"]:
+                    connection.close(); # answered too late
+                else:
+                    state["connection"] = connection;
+
+        thread = threading.Thread(target=handshake, daemon=True);
+        thread.start();
+        thread.join(self.timeout);
+        with lock:
+            state["abandoned"] = True;
+            return state["connection"];
+
+    def drop(self, address):
+        """
+        Closes the connection to a worker that failed or hangs, and waits retryDelay before reconnecting to it.
+        """
+        connection = self.connections.get(address);
+        self.connections[address] = None;
+        self.retryAt[address] = time.time() + self.retryDelay;
+        if connection is not None:
+            try:
+                connection.close();
+            except OSError:
+                pass;
+
+    def evaluate(self, individuals, bank):
+        """
+        Evaluates individuals on the workers.
+
+        :param individuals: trees to evaluate.
+        :param bank:        the EnemyTrajectoryBank of the current generation.
+        :return:            the mean fitness of each individual, in the same order.
+        """
+        compiled = [(utils.lookupTable(individual).tobytes(), individual.depth()) for individual in individuals];
+        return self.evaluateCompiled(compiled, bank.describe());
+
+    def evaluateCompiled(self, compiled, bankDescription):
+        """
+        Evaluates (table bytes, depth) pairs upon the bank built from the given description.
+        """
+        key = bankKey(bankDescription);
+        fitness = [None] * len(compiled);
+        pending = queue.Queue();
+        for start in range(0, len(compiled), self.batchSize):
+            pending.put(start);
+
+        remaining = [len(range(0, len(compiled), self.batchSize))];
+        failures = [];
+        lock = threading.Lock();
+        finished = threading.Event();
+        if remaining[0] == 0: finished.set();
+
+        def feed(address):
+            # Each worker takes the next batch as soon as it is free, balancing the load
+            while not finished.is_set():
+                try:
+                    start = pending.get(timeout=0.1);
+                except queue.Empty:
+                    continue;
+
+                connection = self.connect(address);
+                if connection is None:
+                    pending.put(start);
+                    break;
+
+                try:
+                    if self.banks[address] != key:
+                        connection.send(("bank", key, bankDescription));
+                        self.banks[address] = key;
+                    connection.send(("evaluate", start, key, compiled[start:start + self.batchSize]));
+                    if not connection.poll(self.timeout):
+                        raise TimeoutError("Worker %s:%i did not answer in time" % address);
+                    kind, batchId, result = connection.recv();
+                except (EOFError, OSError):
+                    # Worker failed or hangs: resubmit its batch to the others
+                    self.drop(address);
+                    pending.put(start);
+                    break;
+
+                with lock:
+                    if kind == "error":
+                        failures.append(result);
+                        finished.set();
+                        break;
+                    fitness[start:start + len(result)] = result;
+                    remaining[0] -= 1;
+                    if remaining[0] == 0:
+                        finished.set();
+
+        threads = [threading.Thread(target=feed, args=(address,)) for address in self.addresses];
+        for thread in threads:
+            thread.start();
+        for thread in threads:
+            thread.join();
+
+        if failures:
+            raise RuntimeError("Worker failed to evaluate a batch: %s" % failures[0]);
+        if not finished.is_set():
+            raise RuntimeError("Every worker of the farm is down");
+        return fitness;
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        """
+        for address, connection in self.connections.items():
+            if connection is not None:
+                try:
+                    connection.send(("close",));
+                    connection.close();
+                except OSError:
+                    pass;
+        self.connections = {};
+        self.banks = {};
+
+
+if __name__ == "__main__":
+
+    if sys.argv[1] == "worker":
+        serveWorker((sys.argv[2], int(sys.argv[3])), environmentAuthkey());
+
+    elif sys.argv[1] == "demo":
+        import multiprocessing
+        import signal
+        import socket
+        import time
+        import numpy as np
+
+        def freePort():
+            s = socket.socket();
+            s.bind(("localhost", 0));
+            port = s.getsockname()[1];
+            s.close();
+            return port;
+
+        authkey = os.urandom(16);
+        addresses = [("localhost", freePort()) for i in range(int(sys.argv[2]))];
+        workers = [multiprocessing.Process(target=serveWorker, args=(address, authkey), daemon=True)
+                   for address in addresses];
+        for worker in workers:
+            worker.start();
+        time.sleep(1.);
+
+        rng = np.random.default_rng(0);
+        bank = utils.EnemyTrajectoryBank(5, seed=0);
+        compiled = [(utils.randomTable(rng).tobytes(), int(rng.integers(1, 9))) for i in range(500)];
+
+        farm = EvaluationFarm(addresses, authkey, batchSize=16, timeout=2., retryDelay=0.);
+        expected = evaluateBatch(bank, compiled);
+        assert farm.evaluateCompiled(compiled, bank.describe()) == expected;
+        print("Farm of %i workers agrees with local evaluation" % len(workers));
+
+        workers[0].terminate(); # the other workers take over its batches
+        workers[0].join();
+        assert farm.evaluateCompiled(compiled, bank.describe()) == expected;
+        print("Farm recovered from a failed worker");
+
+        if len(workers) > 2:
+            os.kill(workers[1].pid, signal.SIGSTOP); # hangs without closing its connection
+            try:
+                assert farm.evaluateCompiled(compiled, bank.describe()) == expected;
+                print("Farm recovered from a hung worker");
+
+                began = time.time(); # reconnects to the hung worker, which never completes the handshake
+                assert farm.evaluateCompiled(compiled, bank.describe()) == expected;
+                print("Farm skipped the hung worker when reconnecting (%.1fs)" % (time.time() - began));
+            finally:
+                os.kill(workers[1].pid, signal.SIGCONT);
+        farm.close();
@@ -6,14 +6,15 @@ contains genetic operators (such as crossover and
 mutation).
 """
 
-import random;
+import numpy as np;
 import genetic_operators;
 from tree import Tree;
 import utils;
+import termination;
 
 class GeneticProgramming:
 
-    def __init__(self,populationSize,maxGenerations,elitismPercentage=0.1,crossoverProbability=0.5,tournamentSize=5,mutationPercentage=0.05,mutationProbability=0.03):
+    def __init__(self,populationSize,maxGenerations,elitismPercentage=0.1,crossoverProbability=0.5,tournamentSize=5,mutationPercentage=0.05,mutationProbability=0.03,numEpisodes=5,farm=None,seed=None,baseLevel=None):
         """
         "Constructor" of the class. Initializes the main components and parameters
         of the Genetic Program.
@@ -29,6 +30,18 @@ class GeneticProgramming:
                                      generation. Default value is 0.05 (5%).
         :param mutationProbability:  probability of occurring mutation in a given individual. Default value is
                                      0.03 (3%).
+        :param numEpisodes:          number of enemy walks each individual is evaluated upon. Every individual
+                                     of a generation faces the same walks. Default value is 5.
+        :param farm:                 optional evaluator of the population on other processes: an
+                                     evaluation_farm.EvaluationFarm (remote workers) or a
+                                     shared_evaluation.SharedEvaluationPool (local workers through shared
+                                     memory). Default value is None (evaluation in this process).
+        :param seed:                 seed of the run: an integer or a numpy.random.SeedSequence (e.g. one of the
+                                     children of SeedSequence.spawn). Every random draw of the run comes from
+                                     streams spawned from it, so runs do not depend on how evaluation is spread
+                                     over workers. Default value is None (fresh entropy).
+        :param baseLevel:            level the individuals are evaluated upon, e.g. a workloads.loadPreset
+                                     level. Default value is None (utils.base_level).
         """
         self.functions = [utils.isHole1StepsLeft,utils.isPlain1StepsLeft,utils.isEnemy1StepsLeft, 
                         utils.isHole2StepsLeft,utils.isPlain2StepsLeft,utils.isEnemy2StepsLeft,
@@ -59,6 +72,25 @@ class GeneticProgramming:
                # Probabilidade de Mutacao dos nodos
         self.mutationProbability = mutationProbability;
 
+        # Numero de episodios por individuo
+        self.numEpisodes = numEpisodes;
+
+        # Fase avaliada e trajetorias dos inimigos compartilhadas pela geracao
+        self.baseLevel = baseLevel;
+        self.trajectoryBank = None;
+
+        # Fluxos aleatorios: um para os operadores e um por geracao para os inimigos
+        self.seedSequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed);
+        operatorsSeed, self.banksSeed = self.seedSequence.spawn(2);
+        self.rng = np.random.default_rng(operatorsSeed);
+
+        # Avaliacao distribuida
+        self.farm = farm;
+
+        # Avaliacoes de fitness realizadas e motivo da parada
+        self.numEvaluations = 0;
+        self.stopReason = None;
+
 
     def generateInitialPopulation(self):
         """
@@ -67,21 +99,62 @@ class GeneticProgramming:
         # Código para geração da população inicial
         pass
 
-    def run(self):
+    def evaluateIndividual(self, individual):
+        """
+        Sets the fitness of an individual as its mean fitness over the episodes
+        of the current generation's enemy trajectory bank.
+        """
+        total = 0.;
+        for episode in range(self.numEpisodes):
+            total += utils.calculateFitness(individual, self.trajectoryBank, episode);
+        individual.fitness = total / self.numEpisodes;
+        self.numEvaluations += 1;
+        return individual.fitness;
+
+    def evaluatePopulation(self, individuals):
+        """
+        Sets the fitness of the given individuals, on the evaluation farm if there is one.
+        """
+        if self.farm is None:
+            for individual in individuals:
+                self.evaluateIndividual(individual);
+            return;
+
+        fitness = self.farm.evaluate(individuals, self.trajectoryBank);
+        for individual, value in zip(individuals, fitness):
+            individual.fitness = value;
+        self.numEvaluations += len(individuals);
+
+    def run(self, criterion=None):
         """
         Executes the genetic program.
+
+        :param criterion: optional termination.Criterion to stop the execution before
+                          maxGenerations. The reason the run stopped is kept in stopReason.
         :return: the best individual (solution) found to the problem.
         """
+        stop = termination.MaxGenerations(self.maxGenerations);
+        if criterion is not None:
+            stop = stop | criterion;
+        stop.start();
 
-        numGenerations = 0;
+        state = termination.RunState();
+        self.numEvaluations = 0;
+
+        while(True):
+            self.stopReason = stop.check(state);
+            if self.stopReason is not None:
+                break;
 
-        while(numGenerations < self.maxGenerations):
             newGeneration = [];
 
+            # Every individual of this generation faces the same enemy walks
+            bankSeed = self.banksSeed.spawn(1)[0];
+            self.trajectoryBank = utils.EnemyTrajectoryBank(self.numEpisodes, baseLevel=self.baseLevel,
+                                                            seed=bankSeed.entropy, spawnKey=bankSeed.spawn_key);
+
             #Coloque aqui o seu código para execução de GP
 
-            numGenerations = numGenerations + 1;
+            state.numGenerations = state.numGenerations + 1;
 
         return self.population[0];
-
-
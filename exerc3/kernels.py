@@ -0,0 +1,192 @@
+"""kernels.py
+
+This file stands for the compiled simulation kernel of the
+fitness function. The kernel is compiled with Numba when it
+is installed; otherwise utils falls back to its pure Python
+simulation.
+
+Running this file checks the pure Python simulation against
+reference fitness values, checks that the kernel agrees with it
+(run as plain Python, and compiled when Numba is installed) and
+reports the speedup of the compiled kernel.
+"""
+
+import numpy as np
+
+try:
+    import numba
+    backend = "numba";
+except ImportError:
+    numba = None;
+    backend = "python";
+
+plain = 0;
+hole = 1;
+enemy = 2;
+outOfLevel = 3;
+
+maxSteps = 80; # simulation steps of an episode, shared with utils
+
+
+def asArray(values):
+    """
+    Views an array.array as a numpy array when the kernel is compiled, without copying it.
+    :param values: an array.array, or a numpy array (returned as is).
+    :return: the values, as expected by the current backend.
+    """
+    if backend == "numba" and not isinstance(values, np.ndarray):
+        return np.frombuffer(values, dtype=values.typecode);
+    return values;
+
+
+def jit(function):
+    """
+    Compiles the given function with Numba, if available.
+    """
+    if backend == "numba":
+        return numba.njit(cache=True)(function);
+    return function;
+
+
+@jit
+def simulateEpisode(terrain, positions, start, numEnemies, table, moveDirection, moveSteps, moveJump, depth):
+    """
+    Simulates an episode of a tree compiled into a lookup table, replaying a
+    precomputed enemy walk. Mirrors utils.replayTable.
+
+    :param terrain:     tile codes of the level without enemies.
+    :param positions:   enemy positions of the trajectory bank.
+    :param start:       offset in positions of the first step of the episode.
+    :param numEnemies:  number of enemies of each step.
+    :param table:       lookup table from encoded windows to move indexes.
+    :param moveDirection, moveSteps, moveJump: moves decomposed by move index.
+    :param depth:       depth of the tree.
+    :return: the calculated fitness
+    """
+    tiles = terrain.copy();
+    alive = np.ones(numEnemies, dtype=np.int8);
+    n = len(tiles);
+
+    fitness = 0.;
+    stepCounter = 0;
+    position = 0;
+    current = start;
+
+    for k in range(numEnemies):
+        tiles[positions[current + k]] = enemy;
+
+    while position < n and stepCounter < maxSteps:
+
+        code = 0;
+        for offset in (-2, -1, 1, 2):
+            neighbour = position + offset;
+            if 0 <= neighbour < n:
+                code = code * 4 + int(tiles[neighbour]);
+            else:
+                code = code * 4 + outOfLevel;
+        move = table[code];
+
+        # Enemy walk replayed from the bank
+        previous = current;
+        current += numEnemies;
+        for k in range(numEnemies):
+            if alive[k]:
+                tiles[positions[previous + k]] = plain;
+        for k in range(numEnemies):
+            if alive[k]:
+                tiles[positions[current + k]] = enemy;
+
+        direction = int(moveDirection[move]);
+        jump = moveJump[move];
+
+        for i in range(moveSteps[move]):
+            position += direction;
+
+            if position < 0:
+                position = 0;
+                break;
+
+            if position >= n:
+                break;
+
+            if tiles[position] != plain and not jump:
+                fitness -= 10; # Mario morreu
+                stepCounter = 100;
+
+        if position >= n:
+            fitness += (maxSteps - stepCounter) / 2; # Mario passou de fase
+            break;
+
+        if jump and tiles[position] == enemy:
+            fitness += 2; # Mario kills an enemy
+            tiles[position] = plain;
+            low = 0;
+            high = numEnemies - 1;
+            while low < high:
+                middle = (low + high) // 2;
+                if positions[current + middle] < position:
+                    low = middle + 1;
+                else:
+                    high = middle;
+            alive[low] = 0;
+
+        if tiles[position] == hole:
+            fitness -= 10; # Mario morreu
+            stepCounter = 100;
+
+        stepCounter += 1;
+
+    fitness += position;
+    fitness -= depth / 2;
+
+    if stepCounter > 100:
+        fitness -= 8;
+
+    return fitness;
+
+
+if __name__ == "__main__":
+    import time
+    import utils
+
+    # Fitness of every 200th episode of the check, replayed by utils.replayTable
+    reference = [-2.0, -3.0, -2.0, -2.0, -3.0, -4.0, -3.5, -16.0, -2.5, -3.0,
+                 -2.0, -15.5, 7.0, -19.0, -1.5, -0.5, -15.5, -27.0, -1.5, -2.0];
+
+    rng = np.random.default_rng(0);
+    bank = utils.EnemyTrajectoryBank(20, seed=0);
+    tables = [(utils.randomTable(rng), int(rng.integers(1, 9))) for i in range(200)];
+
+    terrain = np.frombuffer(bank.terrainCodes, dtype=np.int8);
+    positions = np.frombuffer(bank.positions, dtype=bank.positions.typecode);
+    moves = [np.asarray(values, dtype=np.int8) for values in (utils.moveDirection, utils.moveSteps, utils.moveJump)];
+
+    def runPython():
+        return [utils.replayTable(table, depth, bank, episode)
+                for table, depth in tables for episode in range(bank.numEpisodes)];
+
+    def runKernel(kernel):
+        return [kernel(terrain, positions, bank.offset(episode, 0), bank.numEnemies,
+                       np.frombuffer(table, dtype=np.int8), *moves, depth)
+                for table, depth in tables for episode in range(bank.numEpisodes)];
+
+    began = time.time();
+    expected = runPython();
+    pythonTime = time.time() - began;
+
+    assert expected[::200] == reference, "Python simulation disagrees with the reference";
+    assert runKernel(getattr(simulateEpisode, "py_func", simulateEpisode)) == expected, "uncompiled kernel disagrees";
+    print("Python simulation and uncompiled kernel agree on %i episodes" % len(expected));
+
+    if backend != "numba":
+        print("Numba is not installed; the compiled kernel was not checked.");
+    else:
+        runKernel(simulateEpisode); # compiles the kernel
+
+        began = time.time();
+        obtained = runKernel(simulateEpisode);
+        numbaTime = time.time() - began;
+
+        assert obtained == expected, "compiled kernel disagrees";
+        print("Compiled kernel agrees on %i episodes" % len(expected));
+        print("Python %.3fs, Numba %.3fs, speedup %.1fx" % (pythonTime, numbaTime, pythonTime / numbaTime));
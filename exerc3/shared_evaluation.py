@@ -0,0 +1,220 @@
+"""shared_evaluation.py
+
+This file stands for the evaluation of the population on
+a local process pool through shared memory. The level, the
+enemy trajectories and the population (each tree compiled
+into its lookup table, plus its depth) live in
+multiprocessing.shared_memory blocks. Workers read trees by
+offset and write their fitness into a shared array, so only
+index ranges go through the task queue.
+
+Running this file checks the pool against local evaluation.
+"""
+
+from multiprocessing import shared_memory
+import multiprocessing
+import queue
+
+import numpy as np
+
+import utils
+
+tableSize = 4 ** len(utils.windowOffsets);
+
+
+class SharedBank:
+    """
+    Read-only view of an EnemyTrajectoryBank kept in shared memory, as expected by utils.tableFitness.
+    """
+
+    def __init__(self, terrainCodes, positions, numEpisodes, maxSteps, numEnemies):
+        self.terrainCodes = terrainCodes;
+        self.positions = positions;
+        self.numEpisodes = numEpisodes;
+        self.maxSteps = maxSteps;
+        self.numEnemies = numEnemies;
+
+        names = dict((v, k) for k, v in utils.tileCodes.items());
+        self.terrain = [names[code] for code in terrainCodes.tolist()];
+
+    def terrainArray(self):
+        return self.terrainCodes;
+
+    def positionsArray(self):
+        return self.positions;
+
+    def offset(self, episode, step):
+        return (episode * (self.maxSteps + 1) + step) * self.numEnemies;
+
+
+def attach(blocks, name, dtype, count):
+    """
+    Attaches to a shared memory block, keeping it alive in blocks.
+    :return: a numpy array over the first count items of the block.
+    """
+    block = shared_memory.SharedMemory(name=name);
+    blocks.append(block);
+    return np.ndarray((count,), dtype=dtype, buffer=block.buf);
+
+
+def serve(layout, tasks, done):
+    """
+    Worker loop: evaluates the trees of each (start, stop) range received, until a None arrives.
+    """
+    blocks = [];
+    terrain = attach(blocks, layout["terrain"], np.int8, layout["length"]);
+    positions = attach(blocks, layout["positions"], np.int32, layout["numPositions"]);
+    tables = attach(blocks, layout["tables"], np.int8, layout["capacity"] * tableSize);
+    depths = attach(blocks, layout["depths"], np.int32, layout["capacity"]);
+    fitness = attach(blocks, layout["fitness"], np.float64, layout["capacity"]);
+
+    bank = SharedBank(terrain, positions, layout["numEpisodes"], layout["maxSteps"], layout["numEnemies"]);
+
+    try:
+        while True:
+            task = tasks.get();
+            if task is None:
+                break;
+
+            start, stop = task;
+            for i in range(start, stop):
+                table = tables[i * tableSize:(i + 1) * tableSize];
+                total = 0.;
+                for episode in range(bank.numEpisodes):
+                    total += utils.tableFitness(table, int(depths[i]), bank, episode);
+                fitness[i] = total / bank.numEpisodes;
+            done.put(stop - start);
+    finally:
+        del terrain, positions, tables, depths, fitness, bank;
+        for block in blocks:
+            block.close();
+
+
+class SharedEvaluationPool:
+
+    def __init__(self, bank, capacity, numWorkers=None, chunkSize=16):
+        """
+        Allocates the shared memory blocks and starts the workers.
+
+        :param bank:       an EnemyTrajectoryBank. Later banks must share its level, number of
+                           episodes and number of steps.
+        :param capacity:   maximum number of individuals evaluated at once.
+        :param numWorkers: number of worker processes. Defaults to the number of cores.
+        :param chunkSize:  number of individuals of each task.
+        """
+        self.capacity = capacity;
+        self.chunkSize = chunkSize;
+        self.blocks = {};
+
+        self.terrainBytes = bank.terrainCodes.tobytes();
+        self.terrain = self.allocate("terrain", np.int8, len(bank.terrainCodes));
+        self.terrain[:] = np.frombuffer(self.terrainBytes, dtype=np.int8);
+        self.positions = self.allocate("positions", np.int32, len(bank.positions));
+        self.tables = self.allocate("tables", np.int8, capacity * tableSize);
+        self.depths = self.allocate("depths", np.int32, capacity);
+        self.fitness = self.allocate("fitness", np.float64, capacity);
+
+        self.layout = dict((key, block.name) for key, block in self.blocks.items());
+        self.layout.update(length=len(bank.terrainCodes), numPositions=len(bank.positions), capacity=capacity,
+                           numEpisodes=bank.numEpisodes, maxSteps=bank.maxSteps, numEnemies=bank.numEnemies);
+
+        self.tasks = multiprocessing.Queue();
+        self.done = multiprocessing.Queue();
+        self.workers = [multiprocessing.Process(target=serve, args=(self.layout, self.tasks, self.done), daemon=True)
+                        for i in range(numWorkers or multiprocessing.cpu_count())];
+        for worker in self.workers:
+            worker.start();
+
+    def allocate(self, key, dtype, count):
+        """
+        Allocates a shared memory block.
+        :return: a numpy array over the block.
+        """
+        block = shared_memory.SharedMemory(create=True, size=max(1, count * np.dtype(dtype).itemsize));
+        self.blocks[key] = block;
+        return np.ndarray((count,), dtype=dtype, buffer=block.buf);
+
+    def evaluate(self, individuals, bank):
+        """
+        Evaluates individuals on the workers.
+
+        :param individuals: trees to evaluate, at most capacity of them.
+        :param bank:        the EnemyTrajectoryBank of the current generation.
+        :return:            the mean fitness of each individual, in the same order.
+        """
+        compiled = [(utils.lookupTable(individual), individual.depth()) for individual in individuals];
+        return self.evaluateCompiled(compiled, bank);
+
+    def evaluateCompiled(self, compiled, bank):
+        """
+        Evaluates (lookup table, depth) pairs upon the given bank.
+        """
+        if len(compiled) > self.capacity:
+            raise ValueError("Pool holds at most %i individuals, got %i" % (self.capacity, len(compiled)));
+        if len(bank.positions) != len(self.positions) or bank.terrainCodes.tobytes() != self.terrainBytes:
+            raise ValueError("Bank does not match the level and episodes the pool was created for");
+
+        self.positions[:] = np.frombuffer(bank.positions, dtype=np.int32);
+        for i, (table, depth) in enumerate(compiled):
+            self.tables[i * tableSize:(i + 1) * tableSize] = np.frombuffer(table, dtype=np.int8);
+            self.depths[i] = depth;
+
+        numTasks = 0;
+        for start in range(0, len(compiled), self.chunkSize):
+            self.tasks.put((start, min(start + self.chunkSize, len(compiled))));
+            numTasks += 1;
+
+        finished = 0;
+        while finished < numTasks:
+            try:
+                self.done.get(timeout=1.);
+                finished += 1;
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("A worker of the pool died");
+
+        return self.fitness[:len(compiled)].tolist();
+
+    def close(self):
+        """
+        Stops the workers and releases the shared memory.
+        """
+        for worker in self.workers:
+            self.tasks.put(None);
+        for worker in self.workers:
+            worker.join();
+
+        self.terrain = self.positions = self.tables = self.depths = self.fitness = None;
+        for block in self.blocks.values():
+            block.close();
+            block.unlink();
+        self.blocks = {};
+
+
+if __name__ == "__main__":
+    import time
+    import evaluation_farm
+
+    rng = np.random.default_rng(0);
+    bank = utils.EnemyTrajectoryBank(5, seed=0);
+    compiled = [(utils.randomTable(rng), int(rng.integers(1, 9))) for i in range(1000)];
+
+    began = time.time();
+    expected = evaluation_farm.evaluateBatch(bank, [(table.tobytes(), depth) for table, depth in compiled]);
+    localTime = time.time() - began;
+
+    pool = SharedEvaluationPool(bank, capacity=len(compiled));
+    pool.evaluateCompiled(compiled[:10], bank); # warms the workers up
+
+    began = time.time();
+    obtained = pool.evaluateCompiled(compiled, bank);
+    poolTime = time.time() - began;
+
+    nextBank = utils.EnemyTrajectoryBank(5, seed=1);
+    assert pool.evaluateCompiled(compiled, nextBank) == \
+        evaluation_farm.evaluateBatch(nextBank, [(table.tobytes(), depth) for table, depth in compiled]);
+    pool.close();
+
+    assert obtained == expected, "pool disagrees with local evaluation";
+    print("Pool of %i workers agrees with local evaluation" % len(pool.workers));
+    print("Local %.3fs, pool %.3fs" % (localTime, poolTime));
@@ -0,0 +1,113 @@
+"""termination.py
+
+This file stands for the termination criteria of the
+genetic program. A criterion inspects the state of the
+run at the beginning of every generation and tells
+whether (and why) the run should stop.
+
+Only the criteria GeneticProgramming.run can feed are kept
+here: the run loop does not evaluate the population yet, so
+fitness and evaluation budgets (see exerc1/termination.py)
+would never fire.
+"""
+
+import time;
+
+class RunState:
+    """
+    State of a run, as seen by the termination criteria.
+    """
+
+    def __init__(self):
+        self.numGenerations = 0;
+        self.began = time.time();
+
+    def elapsed(self):
+        """
+        :return: seconds since the run began.
+        """
+        return time.time() - self.began;
+
+
+class Criterion:
+    """
+    Base class of the termination criteria.
+    """
+
+    def start(self):
+        """
+        Resets the criterion for a new run.
+        """
+        pass
+
+    def check(self, state):
+        """
+        :param state: the RunState at the beginning of a generation.
+        :return:      the reason to stop the run, or None to keep going.
+        """
+        raise NotImplementedError("Subclasses must implement check");
+
+    def __or__(self, other):
+        return AnyOf(self, other);
+
+    def __and__(self, other):
+        return AllOf(self, other);
+
+
+class MaxGenerations(Criterion):
+
+    def __init__(self, maxGenerations):
+        self.maxGenerations = maxGenerations;
+
+    def check(self, state):
+        if state.numGenerations >= self.maxGenerations:
+            return "reached %i generations" % self.maxGenerations;
+        return None;
+
+
+class MaxWallTime(Criterion):
+
+    def __init__(self, seconds):
+        self.seconds = seconds;
+
+    def check(self, state):
+        if state.elapsed() >= self.seconds:
+            return "exceeded %.1f seconds" % self.seconds;
+        return None;
+
+
+class AnyOf(Criterion):
+    """
+    Stops as soon as any of the given criteria is met.
+    """
+
+    def __init__(self, *criteria):
+        self.criteria = criteria;
+
+    def start(self):
+        for criterion in self.criteria:
+            criterion.start();
+
+    def check(self, state):
+        reasons = [criterion.check(state) for criterion in self.criteria]; # every criterion sees every generation
+        reasons = [reason for reason in reasons if reason is not None];
+        return "; ".join(reasons) if reasons else None;
+
+
+class AllOf(Criterion):
+    """
+    Stops only when all the given criteria are met.
+    """
+
+    def __init__(self, *criteria):
+        self.criteria = criteria;
+
+    def start(self):
+        for criterion in self.criteria:
+            criterion.start();
+
+    def check(self, state):
+        reasons = [criterion.check(state) for criterion in self.criteria];
+        if None in reasons:
+            return None;
+        return " and ".join(reasons);
@@ -5,9 +5,15 @@ when evaluating the level vector.
 """
 
 from enum import Enum
-import random
+from array import array
+from collections import OrderedDict
+import bisect
 import sys
 
+import numpy as np
+
+import kernels
+
 base_level = ['P','P','P','H','P','P','H','P','P','E','P','P','P','H','H','P','H','H','P','P','E','P','E','P','E','H','H','P','P','E','P','H','H','P','P'];
 level = [];
 
@@ -27,6 +33,114 @@ class Moves(Enum):
     run_left = "LQ_"
 
 
+moveValues = [m.value for m in Moves];
+
+# Moves decomposed for the compiled kernel
+moveDirection = kernels.asArray(array('b', [1 if "R" in m else -1 for m in moveValues]));
+moveSteps = kernels.asArray(array('b', [3 if "Q" in m else 2 for m in moveValues]));
+moveJump = kernels.asArray(array('b', [1 if "J" in m else 0 for m in moveValues]));
+
+# Tiles sensed by the tree, relative to Mario's position
+windowOffsets = (-2, -1, 1, 2);
+tileCodes = {LevelPositionTypes.plain.value: 0, LevelPositionTypes.hole.value: 1, LevelPositionTypes.enemy.value: 2};
+outOfLevel = 3;
+
+# Simulation steps of an episode; enemy trajectories are precomputed for all of them
+maxSteps = kernels.maxSteps;
+
+# Lookup tables of recently compiled trees, keyed by their structure (least recently used first)
+tableCache = OrderedDict();
+tableCacheSize = 4096;
+
+
+class EnemyTrajectoryBank:
+    """
+    Precomputed enemy random walks shared by every individual of a generation.
+
+    Each episode stores the position of every enemy at each step of the
+    simulation, so individuals are compared under the same random world
+    (common random numbers) and the walk is drawn only once per generation.
+    Enemies walk as if nobody was killed; kills are applied by each
+    evaluation as a mask over the shared trajectory.
+    """
+
+    def __init__(self, numEpisodes, baseLevel=None, seed=None, spawnKey=()):
+        """
+        Walks are precomputed for the maxSteps steps of an episode.
+
+        :param numEpisodes: number of independent enemy walks to precompute.
+        :param baseLevel:   level to walk the enemies upon. Defaults to base_level.
+        :param seed:        entropy of the numpy.random.SeedSequence of the walks. Defaults to fresh entropy.
+        :param spawnKey:    spawn key of the SeedSequence, when it was spawned from another one.
+        """
+        if baseLevel is None: baseLevel = base_level;
+        seedSequence = np.random.SeedSequence(seed, spawn_key=spawnKey);
+
+        self.numEpisodes = numEpisodes;
+        self.maxSteps = maxSteps; # replays index the trajectory by step, up to this constant
+        self.baseLevel = baseLevel;
+        self.seed = seedSequence.entropy;
+        self.spawnKey = tuple(seedSequence.spawn_key);
+
+        # Level without enemies; enemies are placed by the evaluation at each step
+        self.terrain = [LevelPositionTypes.plain.value if tile == LevelPositionTypes.enemy.value else tile
+                        for tile in baseLevel];
+        start = [i for i, tile in enumerate(baseLevel) if tile == LevelPositionTypes.enemy.value];
+        self.numEnemies = len(start);
+        self.terrainCodes = array('b', [tileCodes[tile] for tile in self.terrain]);
+
+        # positions[((episode * (maxSteps + 1)) + step) * numEnemies + enemy]
+        self.positions = array('i');
+
+        # Each episode draws from its own stream, so episodes do not depend on each other
+        for stream in seedSequence.spawn(numEpisodes):
+            self._walk(np.random.default_rng(stream), list(start));
+
+    def _walk(self, rng, current):
+        """
+        Appends one episode of enemy walks, starting from the given positions.
+        Enemies never cross each other, so they are kept sorted by position.
+        """
+        occupied = set(current);
+        self.positions.extend(current);
+
+        draws = rng.integers(0, 3, size=(self.maxSteps, self.numEnemies)).tolist();
+        for step in range(self.maxSteps):
+            for k in range(self.numEnemies):
+                target = current[k] + draws[step][k] - 1;
+                if 0 <= target < len(self.terrain) and target not in occupied \
+                        and self.terrain[target] == LevelPositionTypes.plain.value:
+                    occupied.discard(current[k]);
+                    occupied.add(target);
+                    current[k] = target;
+            self.positions.extend(current);
+
+    def describe(self):
+        """
+        :return: the arguments that rebuild this bank, e.g. on a remote worker.
+        """
+        return dict(numEpisodes=self.numEpisodes,
+                    baseLevel=list(self.baseLevel), seed=self.seed, spawnKey=self.spawnKey);
+
+    def terrainArray(self):
+        """
+        :return: the terrain tile codes, as expected by the kernels module.
+        """
+        return kernels.asArray(self.terrainCodes);
+
+    def positionsArray(self):
+        """
+        :return: the enemy positions, as expected by the kernels module.
+        """
+        return kernels.asArray(self.positions);
+
+    def offset(self, episode, step):
+        """
+        :return: index in positions of the first enemy at the given episode and step.
+        """
+        return (episode * (self.maxSteps + 1) + step) * self.numEnemies;
+
+
 def isHole1StepsRight(pos):
     """
     Verifies if the given position is a hole.
@@ -143,29 +257,154 @@ def isPlain2StepsLeft(pos):
     return level[pos - 2] == LevelPositionTypes.plain.value;
 
 
-def calculateFitness(tree):
+def encodeWindow(pos):
+    """
+    Encodes the tiles sensed around the given position as an index of a lookup table.
+    :param pos: the level vector position
+    :return: an integer in [0, 4 ** len(windowOffsets)).
+    """
+    code = 0;
+    for offset in windowOffsets:
+        neighbour = pos + offset;
+        if 0 <= neighbour < len(level):
+            code = code * 4 + tileCodes[level[neighbour]];
+        else:
+            code = code * 4 + outOfLevel;
+    return code;
+
+
+def windowLevel(code):
+    """
+    Builds the smallest level in which the given window is sensed.
+    :param code: a window as encoded by encodeWindow.
+    :return: the level and the position Mario senses the window from, or None if
+             the window can not happen (e.g. a tile out of the level between Mario
+             and a tile inside it).
+    """
+    tiles = [];
+    for i in range(len(windowOffsets)):
+        tiles.insert(0, code % 4);
+        code //= 4;
+
+    left, right = tiles[:2], tiles[2:];
+    if (left[1] == outOfLevel and left[0] != outOfLevel) or (right[0] == outOfLevel and right[1] != outOfLevel):
+        return None;
+
+    names = dict((v, k) for k, v in tileCodes.items());
+    window = [names[t] for t in left if t != outOfLevel];
+    pos = len(window);
+    window.append(LevelPositionTypes.plain.value); # Mario's own tile is never sensed
+    window.extend(names[t] for t in right if t != outOfLevel);
+    return window, pos;
+
+
+def randomTable(rng):
+    """
+    Draws a lookup table with a random move for every window that can happen,
+    e.g. to check or time the evaluation without building trees.
+    :param rng: the numpy.random.Generator to draw from.
+    :return: a lookup table, as given by lookupTable.
+    """
+    table = array('b', [-1] * (4 ** len(windowOffsets)));
+    possible = [code for code in range(len(table)) if windowLevel(code) is not None];
+    for code, move in zip(possible, rng.integers(0, len(moveValues), size=len(possible)).tolist()):
+        table[code] = move;
+    return table;
+
+
+def compileTree(tree):
+    """
+    Compiles the decisions of a tree into a dense lookup table from encoded
+    windows to indexes of moveValues. Impossible windows are set to -1.
+    """
+    global level
+    saved = level;
+
+    table = array('b', [-1] * (4 ** len(windowOffsets)));
+    try:
+        for code in range(len(table)):
+            built = windowLevel(code);
+            if built is None: continue;
+            level, pos = built;
+            table[code] = moveValues.index(tree.evaluateTree(pos));
+    finally:
+        level = saved;
+
+    return table;
+
+
+def treeKey(tree):
+    """
+    Builds the structural key of a tree: the names of its functions and terminals
+    in prefix order. Functions are binary and terminals are leaves, so the key
+    determines the tree.
+
+    Expects tree.root to be the root node, and each node to have a value (one of the
+    functions or terminals of GeneticProgramming) and a list of children.
+    :return: a tuple of names.
+    """
+    names = [];
+    stack = [tree.root];
+    while stack:
+        node = stack.pop();
+        names.append(node.value.__name__ if callable(node.value) else node.value);
+        stack.extend(reversed(node.children));
+    return tuple(names);
+
+
+def lookupTable(tree):
+    """
+    :return: the lookup table of the given tree. Structurally equal trees share
+             the same table, which is compiled only once while it stays among the
+             tableCacheSize most recently used ones.
+    """
+    key = treeKey(tree);
+    table = tableCache.get(key);
+    if table is None:
+        table = compileTree(tree);
+        tableCache[key] = table;
+        if len(tableCache) > tableCacheSize:
+            tableCache.popitem(last=False);
+    else:
+        tableCache.move_to_end(key);
+    return table;
+
+
+def calculateFitness(tree, bank=None, episode=0, rng=None):
     """
     Calculates the fitness of the tree (individual).
 
+    :param bank:    optional EnemyTrajectoryBank to replay the enemy walk from.
+                    Without it, enemies walk with numbers drawn from rng.
+    :param episode: episode of the bank to replay.
+    :param rng:     numpy.random.Generator of the enemy walk when there is no bank.
+                    Defaults to a generator with fresh entropy.
     :return: the calculated fitness
     """
+    if bank is not None:
+        return replayFitness(tree, bank, episode);
+
+    if rng is None: rng = np.random.default_rng();
+
     fitness = 0;
     state = 0; # Start with small size
     position = 0; # Start position
     stepCounter = 0;
 
+    table = lookupTable(tree);
+
     global level
     level = list(base_level);
 
-    while(position < len(level) and stepCounter < 80):
+    while(position < len(level) and stepCounter < maxSteps):
 
-        calculatedStep = tree.evaluateTree(position);
+        calculatedStep = moveValues[table[encodeWindow(position)]];
 
 
         # Enemy walk random
         for i in range(len(level)):
                 if level[i] == LevelPositionTypes.enemy.value:
-                        rand = random.randint(0,2);
+                        rand = rng.integers(0, 3);
                         if level[i + rand - 1] == LevelPositionTypes.plain.value:
                                 level[i + rand - 1] = LevelPositionTypes.enemy.value
                                 level[i] = LevelPositionTypes.plain.value
@@ -199,7 +438,7 @@ def calculateFitness(tree):
                         stepCounter = 100;
 
         if position >= len(level):
-                fitness += (80 - stepCounter)/2; # Mario passou de fase
+                fitness += (maxSteps - stepCounter)/2; # Mario passou de fase
                 break;
 
         if  "J" in calculatedStep and level[position] == LevelPositionTypes.enemy.value:
@@ -223,3 +462,120 @@ def calculateFitness(tree):
     return fitness;
 
 
+def replayFitness(tree, bank, episode):
+    """
+    Calculates the fitness of the tree (individual) replaying the given episode
+    of a precomputed enemy walk. Killed enemies are masked out of the trajectory.
+
+    :return: the calculated fitness
+    """
+    return tableFitness(lookupTable(tree), tree.depth(), bank, episode);
+
+
+def tableFitness(table, depth, bank, episode):
+    """
+    Replays an episode for a tree compiled into a lookup table. Uses the
+    compiled kernel when Numba is available.
+
+    :param table: lookup table of the tree, as given by lookupTable.
+    :param depth: depth of the tree.
+    :return: the calculated fitness
+    """
+    if kernels.backend == "numba":
+        return kernels.simulateEpisode(bank.terrainArray(), bank.positionsArray(), bank.offset(episode, 0),
+                                       bank.numEnemies, kernels.asArray(table), moveDirection, moveSteps,
+                                       moveJump, depth);
+
+    return replayTable(table, depth, bank, episode);
+
+
+def replayTable(table, depth, bank, episode):
+    """
+    Pure Python replay of an episode for a tree compiled into a lookup table.
+
+    :param table: lookup table of the tree, as given by lookupTable.
+    :param depth: depth of the tree.
+    :return: the calculated fitness
+    """
+    fitness = 0;
+    stepCounter = 0;
+    position = 0;
+    walk = 0; # Current step of the enemy trajectory
+
+    global level
+    level = list(bank.terrain);
+
+    alive = [True] * bank.numEnemies;
+    start = bank.offset(episode, walk);
+    for k in range(bank.numEnemies):
+        level[bank.positions[start + k]] = LevelPositionTypes.enemy.value;
+
+    while(position < len(level) and stepCounter < maxSteps):
+
+        calculatedStep = moveValues[table[encodeWindow(position)]];
+
+        # Enemy walk replayed from the bank
+        previous = bank.offset(episode, walk);
+        walk += 1;
+        start = bank.offset(episode, walk);
+        for k in range(bank.numEnemies):
+                if alive[k]:
+                        level[bank.positions[previous + k]] = LevelPositionTypes.plain.value;
+        for k in range(bank.numEnemies):
+                if alive[k]:
+                        level[bank.positions[start + k]] = LevelPositionTypes.enemy.value;
+
+        steps = 0;
+        direction = 0;
+
+        if "R" in calculatedStep:
+                direction = 1;
+        else:
+                direction = -1;
+
+        if "Q" in calculatedStep:
+                steps = 3;
+        else:
+                steps = 2;
+
+        for i in range(steps):
+
+                position += direction;
+
+                if position < 0:
+                        position = 0;
+                        break;
+
+                if position >= len(level):
+                        break;
+
+                if level[position] in (LevelPositionTypes.enemy.value, LevelPositionTypes.hole.value) and "J" not in calculatedStep :
+                        fitness = fitness - 10; # Mario morreu
+                        stepCounter = 100;
+
+        if position >= len(level):
+                fitness += (maxSteps - stepCounter)/2; # Mario passou de fase
+                break;
+
+        if  "J" in calculatedStep and level[position] == LevelPositionTypes.enemy.value:
+                fitness = fitness + 2; # Mario kills an enemy
+                level[position] = "P"
+                # Enemies of a step are sorted by position and never share a tile
+                k = bisect.bisect_left(bank.positions, position, start, start + bank.numEnemies) - start;
+                alive[k] = False;
+
+        if level[position] == LevelPositionTypes.hole.value:
+                fitness = fitness - 10; # Mario morreu
+                stepCounter = 100;
+
+
+        stepCounter += 1;
+
+    fitness += position;
+
+    fitness = fitness - depth/2;
+
+    if stepCounter > 100:
+            fitness -= 8
+
+    return fitness;
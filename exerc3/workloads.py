@@ -0,0 +1,177 @@
+"""workloads.py
+
+This file stands for the procedural generation of levels,
+used to measure how fitness evaluation scales with the
+size of the level. Levels are generated in chunks, each
+from its own random stream, straight into byte arrays (one
+byte per tile: b'P', b'H' or b'E') or files.
+
+Running this file times the evaluation upon every preset.
+An episode lasts at most utils.maxSteps (80) steps of at most
+3 tiles, so it never reaches past the first ~240 tiles: above
+that size, the per-episode times only measure copying the
+level and building the trajectory bank, not the evaluation.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import utils
+
+chunkSize = 1 << 20;
+
+# Standard workloads: name -> arguments of generateLevel. Mario moves at most
+# 3 tiles, so runs of more than 2 holes can not be jumped over.
+presets = {
+    "small": dict(length=1000, holeDensity=0.15, enemyDensity=0.05, maxHoleRun=2, seed=1),
+    "medium": dict(length=100000, holeDensity=0.15, enemyDensity=0.05, maxHoleRun=2, seed=2),
+    "large": dict(length=1000000, holeDensity=0.15, enemyDensity=0.05, maxHoleRun=2, seed=3),
+    "huge": dict(length=5000000, holeDensity=0.15, enemyDensity=0.05, maxHoleRun=2, seed=4),
+};
+
+presetsDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workloads");
+
+# Part of the name of preset files, so files written by an older generator are not reused
+generatorVersion = 2;
+
+plain = ord(utils.LevelPositionTypes.plain.value);
+hole = ord(utils.LevelPositionTypes.hole.value);
+enemy = ord(utils.LevelPositionTypes.enemy.value);
+
+
+def generateChunk(rng, length, holeDensity, enemyDensity, maxHoleRun):
+    """
+    Generates a chunk of a level. Every hole run is followed by at least one plain
+    tile, so runs never merge, not even with the runs of the next chunk.
+
+    :return: a numpy array of tiles, one byte each.
+    """
+    tiles = np.full(length, plain, dtype=np.uint8);
+
+    # Hole runs: lengths uniform in [1, maxHoleRun], as many as needed for the hole density
+    numRuns = int(round(holeDensity * length / ((1 + maxHoleRun) / 2.)));
+    lengths = rng.integers(1, maxHoleRun + 1, size=numRuns);
+    free = length - int(np.sum(lengths + 1)); # plain tiles left once each run takes its own plain tile
+    if free < 0:
+        raise ValueError("Hole density %r is too high for runs of at most %i holes" % (holeDensity, maxHoleRun));
+
+    # The free plain tiles are spread at random before the runs
+    gaps = np.diff(np.sort(rng.integers(0, free + 1, size=numRuns)), prepend=0);
+    starts = np.cumsum(gaps) + np.cumsum(lengths + 1) - (lengths + 1);
+    within = np.arange(int(np.sum(lengths))) - np.repeat(np.cumsum(lengths) - lengths, lengths); # index within its run
+    tiles[np.repeat(starts, lengths) + within] = hole;
+
+    # Enemies stand on plain tiles
+    enemies = (tiles == plain) & (rng.random(length) < enemyDensity);
+    tiles[enemies] = enemy;
+
+    return tiles;
+
+
+def generateChunks(length, holeDensity=0.15, enemyDensity=0.05, maxHoleRun=2, seed=None, safeStart=3):
+    """
+    Yields the chunks of a level, each generated from its own stream spawned from the seed.
+
+    :param length:       number of tiles of the level.
+    :param holeDensity:  expected fraction of hole tiles.
+    :param enemyDensity: probability of a plain tile holding an enemy.
+    :param maxHoleRun:   maximum number of consecutive hole tiles of a run.
+    :param seed:         seed of the level.
+    :param safeStart:    number of plain tiles at the start of the level, where Mario stands.
+    """
+    numChunks = (length + chunkSize - 1) // chunkSize;
+    streams = np.random.SeedSequence(seed).spawn(numChunks);
+    for i, stream in enumerate(streams):
+        tiles = generateChunk(np.random.default_rng(stream), min(chunkSize, length - i * chunkSize),
+                              holeDensity, enemyDensity, maxHoleRun);
+        if i == 0:
+            tiles[:safeStart] = plain;
+        yield tiles;
+
+
+def generateLevel(length, **kwargs):
+    """
+    Generates a level in memory. Accepts the arguments of generateChunks.
+
+    :return: a bytearray with one byte per tile.
+    """
+    level = bytearray();
+    for tiles in generateChunks(length, **kwargs):
+        level.extend(tiles.tobytes());
+    return level;
+
+
+def writeLevel(path, length, **kwargs):
+    """
+    Generates a level straight into a file, one chunk at a time. Accepts the arguments of generateChunks.
+    """
+    with open(path, "wb") as f:
+        for tiles in generateChunks(length, **kwargs):
+            tiles.tofile(f);
+
+
+def readLevel(path):
+    """
+    :return: the tiles of a level written by writeLevel, memory-mapped as a numpy array of bytes.
+    """
+    return np.memmap(path, dtype=np.uint8, mode="r");
+
+
+def asLevel(tiles):
+    """
+    Converts the tiles of a generated level into the string of tiles used by utils
+    (e.g. the baseLevel of an EnemyTrajectoryBank).
+    """
+    return bytes(tiles).decode("ascii");
+
+
+def loadPreset(name, directory=None):
+    """
+    Loads a standard workload, writing its file on first use. The level is read
+    fully into memory, since trajectory banks take it as a string of tiles; use
+    readLevel on the file to memory-map it instead.
+
+    :param name:      one of the keys of presets.
+    :param directory: directory of the preset files. Defaults to presetsDirectory.
+    :return: the string of tiles of the level.
+    """
+    if directory is None: directory = presetsDirectory;
+    path = os.path.join(directory, "%s-v%i.level" % (name, generatorVersion));
+    if not os.path.exists(path):
+        if not os.path.exists(directory): os.makedirs(directory);
+        writeLevel(path, **presets[name]);
+    with open(path, "rb") as f:
+        return asLevel(f.read());
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or ["small", "medium", "large"];
+    numEpisodes = 2;
+
+    rng = np.random.default_rng(0);
+    tables = [utils.randomTable(rng) for i in range(50)];
+
+    print("Backend: %s" % utils.kernels.backend);
+    print("Episodes stop after %i steps (at most %i tiles); above that, times measure copying the level." %
+          (utils.maxSteps, 3 * utils.maxSteps));
+    for name in names:
+        level = loadPreset(name);
+
+        began = time.time();
+        bank = utils.EnemyTrajectoryBank(numEpisodes, baseLevel=level, seed=0);
+        bankTime = time.time() - began;
+
+        # Untimed warm-up: compiles the kernel and builds the arrays of the bank
+        utils.tableFitness(tables[0], 5, bank, 0);
+
+        began = time.time();
+        for table in tables:
+            for episode in range(numEpisodes):
+                utils.tableFitness(table, 5, bank, episode);
+        evaluationTime = (time.time() - began) / (len(tables) * numEpisodes);
+
+        print("%-8s %9i tiles %7i enemies: bank %.2fs, %.3fms per episode" %
+              (name, len(level), bank.numEnemies, bankTime, evaluationTime * 1000));